@@ -0,0 +1,273 @@
+"""
+Animations of curves being drawn.
+"""
+
+import collections
+import itertools
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+
+import cairo
+import numpy as np
+from PIL import Image
+
+from curve import Curve
+from render import add_polyline, encode_surface
+from util import dict_to_slug, slug_to_dict
+
+# Importing these registers them as kinds of Curve, for the worker processes.
+from harmonograph import Harmonograph
+from spirograph import Spirograph
+
+
+class Animator:
+    """
+    Draws the frames of a Spirograph being traced, a bit more each frame.
+
+    The curve drawn so far is kept on a surface, so each frame only computes
+    and strokes the part traced since the frame before.  Frames must be
+    requested with increasing numbers of cycles.
+    """
+
+    def __init__(self, curve, size, render=None):
+        self.curve = curve
+        self.size = size
+        self.render = render or curve.render
+        self.surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, *size)
+        self.ctx = self.render.begin(self.surface, size)
+        gray = self.render.gray
+        self.ctx.set_source_rgb(gray, gray, gray)
+        # Round ends and joins make the seams between pieces invisible.
+        self.ctx.set_line_cap(cairo.LINE_CAP_ROUND)
+        self.ctx.set_line_join(cairo.LINE_JOIN_ROUND)
+        self.scale = min(*size) / 2
+        # How many samples have been drawn so far.
+        self.drawn = 0
+
+    def frame(self, cycles, with_more=0):
+        """
+        Draw the curve up to `cycles`, and return the frame as PNG bytes.
+
+        If `with_more` is non-zero, the gears are drawn over the frame with
+        that opacity.
+        """
+        return self._finish_frame(cycles, with_more, encode_surface)
+
+    def frame_pixels(self, cycles, with_more=0):
+        """
+        Like `frame`, but return the raw ARGB32 pixel bytes.
+        """
+        return self._finish_frame(cycles, with_more, surface_pixels)
+
+    def _finish_frame(self, cycles, with_more, output):
+        self.draw_to(cycles)
+        if not with_more:
+            return output(self.surface)
+
+        # The gears are only for this frame, so draw them on a copy.
+        with cairo.ImageSurface(cairo.FORMAT_ARGB32, *self.size) as surface:
+            ctx = cairo.Context(surface)
+            ctx.set_source_surface(self.surface)
+            ctx.paint()
+            self.render.center(ctx)
+            self.curve.draw_more(ctx, scale=self.scale, param=with_more)
+            return output(surface)
+
+    def draw_to(self, cycles):
+        """
+        Stroke the part of the curve from where we left off to `cycles`.
+        """
+        self.curve.max_cycles = cycles
+        start, step, count = self.curve.time_grid(self.render.dt)
+        if count <= self.drawn:
+            return
+        # Start from the last sample drawn, so the pieces connect.
+        t = start + step * np.arange(max(self.drawn - 1, 0), count)
+        pts = self.curve.evaluate(["x", "y"], t) * self.scale
+        add_polyline(self.ctx, pts)
+        self.ctx.stroke()
+        self.drawn = count
+
+
+def surface_pixels(surface):
+    """
+    Get a copy of the pixel data of an ARGB32 surface.
+    """
+    surface.flush()
+    return bytes(surface.get_data())
+
+
+# Frame timing for movies.
+FRAME_MS = 20
+LAST_FRAME_MS = 10_000
+
+# Frames are rendered in batches: each batch draws the curve up to its first
+# frame from scratch, then adds to it incrementally.
+FRAMES_PER_BATCH = 20
+
+# Each worker process gets at most this many batches ahead of the encoder.
+BATCHES_AHEAD = 2
+
+# Pillow holds every frame in memory until the whole movie is written, so it
+# won't be asked to make movies with more than this many bytes of frames.
+PILLOW_MAX_BYTES = 1_000_000_000
+
+
+class MovieTooLong(Exception):
+    """
+    A movie has too many frames to encode without ffmpeg.
+    """
+
+
+def write_movie(curve, size, frames, output, jobs=None, encoder="auto"):
+    """
+    Render the frames of an animation and encode them into a movie file.
+
+    `frames` is a list of (cycles, with_more) pairs, as for Animator.frame.
+    Batches of frames are rendered across `jobs` processes, and fed in order
+    to the encoder, either "pillow", "ffmpeg" or "auto" to use ffmpeg if it
+    is installed.  Frames are never written to disk.
+
+    No more than BATCHES_AHEAD batches per process are rendered ahead of the
+    encoder.  ffmpeg encodes frames as they arrive.  Pillow keeps them all
+    until the end, so MovieTooLong is raised if they would need more than
+    PILLOW_MAX_BYTES.
+    """
+    slug = dict_to_slug(curve.short_parameters())
+    batches = [
+        (slug, size, frames[i:i + FRAMES_PER_BATCH])
+        for i in range(0, len(frames), FRAMES_PER_BATCH)
+    ]
+    if encoder == "auto":
+        encoder = "ffmpeg" if shutil.which("ffmpeg") else "pillow"
+    if encoder == "pillow":
+        width, height = size
+        nbytes = len(frames) * width * height * 3
+        if nbytes > PILLOW_MAX_BYTES:
+            raise MovieTooLong(
+                f"{len(frames)} frames would need {nbytes / 1e9:.1f}GB of memory"
+                + " to encode with Pillow: install ffmpeg to make this movie"
+            )
+
+    jobs = jobs or os.cpu_count()
+    with multiprocessing.Pool(jobs) as pool:
+        results = bounded_imap(pool, render_batch, batches, jobs * BATCHES_AHEAD)
+        pixels = itertools.chain.from_iterable(results)
+        if encoder == "ffmpeg":
+            encode_ffmpeg(pixels, size, output)
+        else:
+            encode_pillow(pixels, size, len(frames), output)
+
+
+def bounded_imap(pool, func, items, window):
+    """
+    Like `pool.imap`, but with no more than `window` items being worked on or
+    waiting to be collected at once.
+    """
+    pending = collections.deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (item,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def render_batch(batch):
+    """
+    Render a batch of frames in a worker process, returning their pixels.
+    """
+    slug, size, frames = batch
+    curve = Curve.any_from_params(slug_to_dict(slug))
+    animator = Animator(curve, size)
+    return [animator.frame_pixels(cycles, with_more) for cycles, with_more in frames]
+
+
+def encode_pillow(pixels, size, nframes, output):
+    """
+    Encode frames into an animated GIF or PNG with Pillow.
+
+    Pillow only stores the changed part of each frame in the file, but it
+    collects all of the frames in memory before writing any of them.
+    """
+    images = (
+        Image.frombuffer("RGB", size, data, "raw", "BGRX", 0, 1) for data in pixels
+    )
+    first = next(images)
+    first.save(
+        output,
+        save_all=True,
+        append_images=images,
+        duration=[FRAME_MS] * (nframes - 1) + [LAST_FRAME_MS],
+        loop=0,
+    )
+
+
+def movie_palette():
+    """
+    The 256 colors for GIF movies, as a list of (r, g, b) tuples.
+
+    Frames are a black line on white, with the red gears drawn over them at
+    some opacity, so the palette is mostly grays, with red tints of some of
+    them.
+    """
+    grays = np.linspace(0, 1, 160)
+    colors = [(g, g, g) for g in grays]
+    for alpha in np.linspace(1, 0, 6, endpoint=False):
+        for g in np.linspace(0, 1, 16):
+            colors.append((g + (1 - g) * alpha, g * (1 - alpha), g * (1 - alpha)))
+    return [tuple(round(c * 255) for c in color) for color in colors]
+
+
+def encode_ffmpeg(pixels, size, output):
+    """
+    Encode frames into a movie by piping them to ffmpeg.
+
+    Each frame is encoded as it arrives: GIFs use the fixed colors of
+    `movie_palette`, since making a palette from the frames would mean
+    holding all of them until the end.
+    """
+    width, height = size
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cmd = [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-y",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "bgra",
+            "-s",
+            f"{width}x{height}",
+            "-framerate",
+            str(1000 // FRAME_MS),
+            "-i",
+            "-",
+        ]
+        # Hold the last frame, like the Pillow encoder does.
+        hold = f"tpad=stop_mode=clone:stop_duration={LAST_FRAME_MS / 1000}"
+        if output.endswith(".gif"):
+            palette_path = os.path.join(tmpdir, "palette.png")
+            palette = Image.new("RGB", (16, 16))
+            palette.putdata(movie_palette())
+            palette.save(palette_path)
+            # Only the changed rectangle of each frame is stored.
+            cmd += [
+                "-i",
+                palette_path,
+                "-filter_complex",
+                f"[0:v]{hold}[v];[v][1:v]paletteuse=diff_mode=rectangle",
+            ]
+        else:
+            cmd += ["-vf", hold, "-pix_fmt", "yuv420p"]
+        cmd.append(output)
+        with subprocess.Popen(cmd, stdin=subprocess.PIPE) as proc:
+            for data in pixels:
+                proc.stdin.write(data)
+            proc.stdin.close()
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed with status {proc.returncode}")
@@ -0,0 +1,124 @@
+"""
+Rendering many images at once, for making catalogues offline.
+"""
+
+import contextlib
+import hashlib
+import multiprocessing
+import os
+from dataclasses import dataclass
+
+from curve import Curve
+from render import draw_png, write_svg
+from util import slug_to_dict
+
+from harmonograph import Harmonograph
+from spirograph import Spirograph
+
+
+@dataclass
+class BatchResult:
+    """
+    What happened when rendering the images for one slug.
+    """
+
+    slug: str
+    written: int = 0
+    skipped: int = 0
+    nbytes: int = 0
+    error: str = None
+
+
+def parse_slug_line(line):
+    """
+    Get (slug, name) from a line of batch input, or None for blank lines and
+    comments.
+
+    A line is a slug or a Flourish URL, optionally followed by a name for the
+    output files.  Without a name, one is made from a hash of the slug, the
+    same as for downloaded images.
+    """
+    words = line.split()
+    if not words or words[0].startswith("#"):
+        return None
+    slug = words[0].rpartition("/")[-1]
+    if len(words) > 1:
+        name = words[1]
+    else:
+        name = "flourish_" + hashlib.md5(slug.encode("ascii")).hexdigest()[:10]
+    return slug, name
+
+
+def output_paths(name, sizes, formats, output_dir):
+    """
+    Get the (size, format, path) for each image to make for one slug.
+    """
+    return [
+        (size, fmt, os.path.join(output_dir, f"{name}_{size[0]}x{size[1]}.{fmt}"))
+        for size in sizes
+        for fmt in formats
+    ]
+
+
+def render_slug(job):
+    """
+    Render all the images for one slug, in a worker process.
+
+    All the sizes are drawn from one Curve, so they share computed samples.
+    """
+    slug, outputs, skipped = job
+    result = BatchResult(slug, skipped=skipped)
+    try:
+        curve = Curve.any_from_params(slug_to_dict(slug))
+        for size, fmt, path in outputs:
+            # Write to a temporary name first, so an interrupted batch doesn't
+            # leave a partial file that a later run would skip.
+            tmp_path = path + ".tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    if fmt == "png":
+                        f.write(draw_png(curve, size, with_metadata=True).getvalue())
+                    else:
+                        # SVGs can be big, so they go straight to the file.
+                        write_svg(curve, size, f)
+                    nbytes = f.tell()
+                os.replace(tmp_path, path)
+            except BaseException:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(tmp_path)
+                raise
+            result.written += 1
+            result.nbytes += nbytes
+    except Exception as exc:
+        result.error = f"{exc.__class__.__name__}: {exc}"
+    return result
+
+
+def render_batch(lines, sizes, formats, output_dir, jobs=None, force=False):
+    """
+    Render images for the slugs in `lines` across `jobs` processes.
+
+    Each slug is drawn at each of `sizes` in each of `formats` ("png" or
+    "svg"), skipping files that already exist unless `force` is true.
+    Produces a BatchResult for each slug as it finishes.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    work = []
+    for line in lines:
+        parsed = parse_slug_line(line)
+        if parsed is None:
+            continue
+        slug, name = parsed
+        outputs = output_paths(name, sizes, formats, output_dir)
+        if not force:
+            todo = [output for output in outputs if not os.path.exists(output[2])]
+        else:
+            todo = outputs
+        skipped = len(outputs) - len(todo)
+        if todo:
+            work.append((slug, todo, skipped))
+        else:
+            yield BatchResult(slug, skipped=skipped)
+
+    with multiprocessing.Pool(jobs) as pool:
+        yield from pool.imap_unordered(render_slug, work)
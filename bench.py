@@ -0,0 +1,270 @@
+"""
+Benchmarks for Flourish: sampling, rendering, encoding, and the web routes.
+
+Each benchmark runs on every curve in bench_corpus.txt, with the sample
+cache emptied first so that every run computes everything.
+
+    python bench.py                         # print timings
+    python bench.py --save base.json        # ...and save them
+    python bench.py --compare base.json     # flag regressions since then
+
+"""
+
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cairo
+import click
+import numpy as np
+
+from cache import DiskCache
+from constants import FULLX, FULLY, THUMBX, THUMBY
+from curve import Curve, sample_cache
+from render import draw_png, draw_svg, lookup
+from util import slug_to_dict
+
+from harmonograph import Harmonograph
+from spirograph import Spirograph
+
+CORPUS_FILE = os.path.join(os.path.dirname(__file__), "bench_corpus.txt")
+
+# Differences smaller than these are noise, not regressions.
+MIN_SECONDS = 0.002
+MIN_MB = 1
+
+
+def load_corpus():
+    """
+    Read the reference curves, returning a list of (name, slug) pairs.
+    """
+    corpus = []
+    with open(CORPUS_FILE) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                name, slug = line.split()
+                corpus.append((name, slug))
+    return corpus
+
+
+def make_curve(slug):
+    return Curve.any_from_params(slug_to_dict(slug))
+
+
+BENCHMARKS = {}
+
+
+def benchmark(unit):
+    """
+    Register a benchmark function, which takes a slug, does its work, and
+    returns how many `unit`s of work it did.
+    """
+
+    def _decorator(func):
+        func.unit = unit
+        BENCHMARKS[func.__name__] = func
+        return func
+
+    return _decorator
+
+
+@benchmark("samples")
+def points(slug):
+    curve = make_curve(slug)
+    nsamples = 0
+    dt = lookup(FULLX, curve.render.DTS)
+    for _ in curve.points(["x", "y"], scale=FULLY / 2, dt=dt):
+        nsamples += 1
+    return nsamples
+
+
+@benchmark("pixels")
+def render_draw(slug):
+    curve = make_curve(slug)
+    size = (FULLX // 2, FULLY // 2)
+    with cairo.ImageSurface(cairo.FORMAT_ARGB32, *size) as surface:
+        curve.render.draw(surface, size, curve)
+    return size[0] * size[1]
+
+
+@benchmark("pixels")
+def png_thumb(slug):
+    draw_png(make_curve(slug), size=(THUMBX, THUMBY))
+    return THUMBX * THUMBY
+
+
+@benchmark("pixels")
+def png_full(slug):
+    draw_png(make_curve(slug), size=(FULLX, FULLY), with_metadata=True)
+    return FULLX * FULLY
+
+
+@benchmark("bytes")
+def svg(slug):
+    return len(draw_svg(make_curve(slug), size=(FULLX // 2, FULLY // 2)))
+
+
+def get_route(url):
+    """
+    Get `url` from the web app, with an empty image cache.
+    """
+    os.environ.setdefault("SECRET_KEY", "bench")
+    import webapp
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        webapp.png_cache = DiskCache(tmpdir, max_bytes=10**9)
+        resp = webapp.app.test_client().get(url)
+    assert resp.status_code == 200, f"{url}: {resp.status}"
+    return len(resp.data)
+
+
+@benchmark("bytes")
+def route_one(slug):
+    return get_route(f"/one/{slug}")
+
+
+@benchmark("bytes")
+def route_png(slug):
+    return get_route(f"/png/{slug}sx{THUMBX * 2}sy{THUMBY * 2}")
+
+
+def run_one(func, slug, repeat):
+    """
+    Run one benchmark on one slug, returning a dict of results.
+
+    The time is the best of `repeat` runs.  The peak memory is measured in
+    another run, since tracing allocations slows things down.
+    """
+    best = None
+    for _ in range(repeat):
+        sample_cache.clear()
+        start = time.perf_counter()
+        units = func(slug)
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+    sample_cache.clear()
+    tracemalloc.start()
+    try:
+        func(slug)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": best, "units": units, "peak_bytes": peak}
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with a baseline, returning a list of regression messages.
+    """
+    regressions = []
+    for bname, runs in results.items():
+        for name, result in runs.items():
+            old = baseline.get(bname, {}).get(name)
+            if old is None:
+                continue
+            old_secs, new_secs = old["seconds"], result["seconds"]
+            if new_secs > old_secs * (1 + threshold) + MIN_SECONDS:
+                regressions.append(
+                    f"{bname} {name}: {old_secs:.4f}s -> {new_secs:.4f}s"
+                )
+            old_mb, new_mb = old["peak_bytes"] / 1e6, result["peak_bytes"] / 1e6
+            if new_mb > old_mb * (1 + threshold) + MIN_MB:
+                regressions.append(
+                    f"{bname} {name}: peak {old_mb:.1f}MB -> {new_mb:.1f}MB"
+                )
+    return regressions
+
+
+def summary_line(bname, runs, unit, baseline=None):
+    seconds = sum(r["seconds"] for r in runs.values())
+    units = sum(r["units"] for r in runs.values())
+    peak = max(r["peak_bytes"] for r in runs.values())
+    line = (
+        f"{bname:12} {seconds:9.3f}s {units / seconds:14,.0f} {unit}/s"
+        + f" {peak / 1e6:9.1f}MB peak"
+    )
+    if baseline and bname in baseline:
+        old_runs = baseline[bname]
+        old = sum(old_runs[name]["seconds"] for name in runs if name in old_runs)
+        if old:
+            line += f"  {seconds / old:6.2f}x baseline time"
+    return line
+
+
+@click.command()
+@click.option(
+    "--bench",
+    "-b",
+    "bnames",
+    multiple=True,
+    type=click.Choice(list(BENCHMARKS)),
+    help="Benchmark to run, can be repeated [all of them]",
+)
+@click.option("--match", "-k", default="", help="Only curves with this in their name")
+@click.option("--repeat", "-r", type=int, default=3, help="Runs to take the best of")
+@click.option("--save", type=click.Path(), help="Write the results to this JSON file")
+@click.option(
+    "--compare",
+    "baseline_file",
+    type=click.Path(exists=True),
+    help="Compare with results saved by --save, failing if slower",
+)
+@click.option(
+    "--threshold",
+    type=float,
+    default=0.1,
+    help="How much worse than the baseline is a regression [0.1 = 10%]",
+)
+@click.option("--verbose", "-v", is_flag=True, help="Show each curve's results")
+def main(bnames, match, repeat, save, baseline_file, threshold, verbose):
+    corpus = [(name, slug) for name, slug in load_corpus() if match in name]
+    baseline = None
+    if baseline_file:
+        with open(baseline_file) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    for bname in bnames or BENCHMARKS:
+        func = BENCHMARKS[bname]
+        runs = results[bname] = {}
+        for name, slug in corpus:
+            runs[name] = result = run_one(func, slug, repeat)
+            if verbose:
+                print(
+                    f"  {bname:12} {name:14} {result['seconds']:9.4f}s"
+                    + f" {result['units']:12,} {func.unit}"
+                    + f" {result['peak_bytes'] / 1e6:9.1f}MB"
+                )
+        print(summary_line(bname, runs, func.unit, baseline))
+
+    if save:
+        with open(save, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "cairo": cairo.cairo_version_string(),
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"Wrote {save}")
+
+    if baseline:
+        regressions = compare(results, baseline, threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
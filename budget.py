@@ -0,0 +1,71 @@
+"""
+Limits on how much work one request can make us do.
+"""
+
+import contextlib
+import math
+import time
+from dataclasses import dataclass
+
+from parameter import GlobalParameter, global_value
+
+
+class OverBudget(Exception):
+    """
+    Drawing would take, or has taken, more than its budget.
+    """
+
+
+# The time.monotonic() value when the current drawing must stop, or None.
+deadline = GlobalParameter("deadline", default=None)
+
+
+def check_deadline():
+    """
+    Raise OverBudget if the current deadline has passed.
+
+    Long-running loops call this every so often.
+    """
+    stop_at = deadline.get()
+    if stop_at is not None and time.monotonic() > stop_at:
+        raise OverBudget("Ran out of time")
+
+
+@dataclass
+class Budget:
+    """
+    The most work we'll do for one image.
+    """
+
+    # The largest image, in pixels.
+    max_pixels: int
+    # The most samples to compute for the curves in the image.
+    max_samples: int
+    # The most wall-clock time to spend drawing.
+    seconds: float
+
+    def fit(self, size):
+        """
+        Shrink `size` if needed to fit in max_pixels, keeping its shape.
+        """
+        width, height = (max(int(v), 1) for v in size)
+        if width * height > self.max_pixels:
+            shrink = math.sqrt(self.max_pixels / (width * height))
+            width = max(int(width * shrink), 1)
+            height = max(int(height * shrink), 1)
+        return width, height
+
+    def check_samples(self, nsamples):
+        """
+        Raise OverBudget if `nsamples` is too many samples to compute.
+        """
+        if nsamples > self.max_samples:
+            raise OverBudget(f"Too many samples: {nsamples}")
+
+    @contextlib.contextmanager
+    def time_limit(self):
+        """
+        Set a deadline for the code in this context.
+        """
+        with global_value(deadline, time.monotonic() + self.seconds):
+            yield
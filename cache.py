@@ -0,0 +1,161 @@
+"""
+Caches for rendered images and computed curves.
+"""
+
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+
+
+class DiskCache:
+    """
+    A directory of files, bounded in total size, that processes can share.
+
+    Keys are strings, hashed to make file names.  Writes are atomic, so a
+    reader never sees a partial file, even from another process.  When the
+    directory grows past `max_bytes`, the least recently used files are
+    deleted.
+    """
+
+    def __init__(self, directory, max_bytes, suffix=""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        # Bytes written by this process since we last measured the directory.
+        # Other processes write too, so we re-measure every so often.
+        self.unmeasured = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + self.suffix)
+
+    def get(self, key):
+        """
+        Get the bytes stored for `key`, or None if they aren't in the cache.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # The modification time is our "last used" time.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def put(self, key, data):
+        """
+        Store the bytes `data` for `key`.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.unmeasured += len(data)
+        if self.unmeasured > self.max_bytes // 10:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete least recently used files until we are under our size limit.
+        """
+        self.unmeasured = 0
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% of the limit so we aren't evicting on every write.
+        target = self.max_bytes * 9 // 10
+        entries.sort()
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class MemoryCache:
+    """
+    An in-process LRU cache of NumPy arrays, bounded by the bytes they hold.
+
+    Cached arrays are made read-only, since they are shared by all callers.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """
+        Get the array for `key`, or call `compute()` to make it if needed.
+        """
+        with self.lock:
+            arr = self.entries.get(key)
+            if arr is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return arr
+            self.misses += 1
+
+        arr = compute()
+        arr.setflags(write=False)
+        if arr.nbytes > self.max_bytes:
+            return arr
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self.entries[key] = arr
+            self.nbytes += arr.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return arr
+
+    def clear(self):
+        """
+        Forget all the cached arrays.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """
+        Return a dict of statistics about the cache.
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "nbytes": self.nbytes,
+            }
@@ -2,76 +2,166 @@
 A simple CLI for Flourish.
 """
 
-import itertools
-import subprocess
-import tempfile
+import sys
+import time
 
 import click
 
+from animate import MovieTooLong, write_movie
+from batch import render_batch
 from constants import FULLX, FULLY
 from curve import Curve
-from render import draw_png
+from poster import TILE_SIZE, draw_poster
 from util import slug_to_dict
 
 from harmonograph import Harmonograph
 from spirograph import Spirograph
 
 
-@click.command()
+@click.group()
+def cli():
+    """
+    Make Flourish images and movies.
+    """
+
+
+@cli.command()
 @click.argument("slug")
-def main(slug):
+@click.option(
+    "--output",
+    default="flourish_movie.gif",
+    help="Movie file to write: .gif, .png, or anything ffmpeg can make",
+)
+@click.option("--jobs", type=int, default=None, help="Worker processes [all cores]")
+@click.option(
+    "--encoder",
+    type=click.Choice(["auto", "pillow", "ffmpeg"]),
+    default="auto",
+    help="How to encode the movie [ffmpeg if available]",
+)
+def movie(slug, output, jobs, encoder):
+    """
+    Make a movie of a curve being drawn.
+    """
     slug = slug.rpartition("/")[-1]
     params = slug_to_dict(slug)
     curve = Curve.any_from_params(params)
-    if 0:
-        png_bytes = draw_png(curve=curve, size=(FULLX, FULLY), with_metadata=True)
-        fname = "flourish.png"
-        with open(fname, "wb") as pngf:
-            pngf.write(png_bytes.read())
-        print(f"Wrote {fname}")
-    if 1:
-        with tempfile.TemporaryDirectory() as tempdir:
-            print(f"In {tempdir}")
-            dθ = .5 / 360
-            ncycles = curve._cycles()
-            print(f"{ncycles = }")
-            framenums = itertools.count()
-            for cycles in slow_then_faster(ncycles, dθ, 1, dθ * 40):
-                if cycles >= ncycles:
-                    cycles = ncycles    # So the last frame is aligned right.
-                curve.max_cycles = cycles
-                if cycles < 2:
-                    with_more = 1
-                elif cycles < 4:
-                    with_more = 2 - (cycles / 2)
-                else:
-                    with_more = 0
-                png_bytes = draw_png(
-                    curve=curve,
-                    size=(FULLX // 2, FULLY // 2),
-                    with_metadata=False,
-                    with_more=with_more,
-                )
-                output = f"{tempdir}/frame_{next(framenums):04d}.png"
-                with open(output, "wb") as pngf:
-                    pngf.write(png_bytes.read())
-
-            print(f"wrote {output}")
-            try:
-                print("waiting...")
-                import time; time.sleep(3600)
-            except KeyboardInterrupt:
-                pass
-            print("Converting...")
-            subprocess.run(
-                "convert "
-                + f"-delay 2 {tempdir}/frame_*.png "
-                + f"-delay 1000 {output} "
-                + "-strip -coalesce "
-                + "-layers Optimize "
-                + "flourish_movie.gif",
-                shell=True,
-            )
+    dθ = .5 / 360
+    ncycles = curve._cycles()
+    print(f"{ncycles = }")
+    frames = []
+    for cycles in slow_then_faster(ncycles, dθ, 1, dθ * 40):
+        if cycles >= ncycles:
+            cycles = ncycles    # So the last frame is aligned right.
+        if cycles < 2:
+            with_more = 1
+        elif cycles < 4:
+            with_more = 2 - (cycles / 2)
+        else:
+            with_more = 0
+        frames.append((cycles, with_more))
+    print(f"Rendering {len(frames)} frames...")
+    try:
+        write_movie(
+            curve,
+            size=(FULLX // 2, FULLY // 2),
+            frames=frames,
+            output=output,
+            jobs=jobs,
+            encoder=encoder,
+        )
+    except MovieTooLong as exc:
+        raise click.ClickException(str(exc))
+    print(f"Wrote {output}")
+
+
+def size_value(value):
+    """
+    Parse a size like "1920x1080" into (1920, 1080).
+    """
+    try:
+        width, height = (int(v) for v in value.lower().split("x"))
+    except ValueError:
+        raise click.BadParameter(f"{value!r} should be like 1920x1080")
+    return width, height
+
+
+def parse_size(ctx, param, value):
+    return size_value(value)
+
+
+def parse_sizes(ctx, param, values):
+    return [size_value(value) for value in values]
+
+
+@cli.command()
+@click.argument("slugs", type=click.File("r"), default="-")
+@click.option(
+    "--size",
+    "sizes",
+    multiple=True,
+    default=[f"{FULLX}x{FULLY}"],
+    callback=parse_sizes,
+    help="Image size, like 1920x1080, can be repeated",
+)
+@click.option(
+    "--format",
+    "formats",
+    multiple=True,
+    type=click.Choice(["png", "svg"]),
+    default=["png"],
+    help="Image format, can be repeated [png]",
+)
+@click.option("--output-dir", default=".", help="Directory to write images to")
+@click.option("--jobs", type=int, default=None, help="Worker processes [all cores]")
+@click.option("--force", is_flag=True, help="Re-render images that already exist")
+def batch(slugs, sizes, formats, output_dir, jobs, force):
+    """
+    Render images for many curves.
+
+    SLUGS is a file (or - for stdin) with a slug or Flourish URL on each line,
+    optionally followed by a name for its images.
+    """
+    start = time.perf_counter()
+    written = skipped = nbytes = errors = 0
+    results = render_batch(slugs, sizes, formats, output_dir, jobs=jobs, force=force)
+    for result in results:
+        written += result.written
+        skipped += result.skipped
+        nbytes += result.nbytes
+        if result.error:
+            errors += 1
+            print(f"Error: {result.slug}: {result.error}", file=sys.stderr)
+    seconds = time.perf_counter() - start
+    rate = written / seconds if seconds else 0
+    print(
+        f"Wrote {written} images ({nbytes / 1e6:.1f} MB), skipped {skipped},"
+        + f" {errors} errors, in {seconds:.1f}s: {rate:.1f} images/s"
+    )
+    if errors:
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument("slug")
+@click.option(
+    "--size",
+    default="20000x20000",
+    callback=parse_size,
+    help="Image size [20000x20000]",
+)
+@click.option("--output", default="flourish_poster.png", help="PNG file to write")
+@click.option("--tile", type=int, default=TILE_SIZE, help="Tile size in pixels")
+@click.option("--jobs", type=int, default=1, help="Worker processes [1]")
+def poster(slug, size, output, tile, jobs):
+    """
+    Draw one very large PNG, a tile at a time.
+    """
+    curve = Curve.any_from_params(slug_to_dict(slug.rpartition("/")[-1]))
+    start = time.perf_counter()
+    with open(output, "wb") as f:
+        draw_poster(curve, size, f, tile_size=tile, jobs=jobs)
+    print(f"Wrote {output} in {time.perf_counter() - start:.1f}s")
 
 
 def slow_then_faster(limit, dmin, min_time, dmax):
@@ -106,4 +196,4 @@ def slow_then_faster(limit, dmin, min_time, dmax):
 
 
 if __name__ == "__main__":
-    main()
+    cli()
@@ -6,8 +6,37 @@ Constants for use throughout Flourish.
 FULLX, FULLY = 1920, 1080
 THUMBX, THUMBY = 192, 108
 
+# Random spirographs on the /spiro page must be less complex than this.
+SPIRO_MAX_COMPLEXITY = 5000
+
 # Cookies
 MANY_SETTINGS_COOKIE = "manysettings"
 
 # PNG metadata
 PNG_STATE_KEY = "Flourish State"
+
+# Uploads bigger than this are refused, and only this much of an uploaded PNG
+# is read looking for our metadata.
+MAX_UPLOAD_BYTES = 20_000_000
+MAX_UPLOAD_SCAN_BYTES = 1_000_000
+
+# Rendered image caching.  Cached images are keyed on a hash of the drawing
+# code (see render.drawing_version), which includes RENDER_VERSION.  The hash
+# notices code changes by itself: bump RENDER_VERSION for changes it can't see.
+RENDER_VERSION = 1
+CACHE_DIR_ENV = "FLOURISH_CACHE_DIR"
+CACHE_MB_ENV = "FLOURISH_CACHE_MB"
+
+# Computed curve samples are cached in memory, up to this many bytes.
+SAMPLE_CACHE_BYTES = 50_000_000
+
+# Profiling the slowest requests: set PROFILE_DIR_ENV to a directory to
+# profile a random PROFILE_RATE_ENV fraction of requests, keeping the
+# slowest PROFILE_KEEP_ENV profiles there.
+PROFILE_DIR_ENV = "FLOURISH_PROFILE_DIR"
+PROFILE_RATE_ENV = "FLOURISH_PROFILE_RATE"
+PROFILE_KEEP_ENV = "FLOURISH_PROFILE_KEEP"
+
+# /metrics is only served if METRICS_TOKEN_ENV is set, to requests with an
+# "Authorization: Bearer <token>" header carrying its value.
+METRICS_TOKEN_ENV = "FLOURISH_METRICS_TOKEN"
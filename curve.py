@@ -1,7 +1,23 @@
+import math
 from dataclasses import dataclass
 
+import numpy as np
+
+from budget import check_deadline
+from cache import MemoryCache
+from constants import FULLY, SAMPLE_CACHE_BYTES
 from parameter import Parameter, Parameterized
 from render import ElegantLine
+from sampling import adaptive_times
+from timing import timed
+
+
+# Samples are cached at unit scale, so one entry serves many image sizes.
+sample_cache = MemoryCache(max_bytes=SAMPLE_CACHE_BYTES)
+
+# Curves too complex to sample all at once are sampled this many time steps
+# at a time by iter_samples.
+STREAM_CHUNK = 50_000
 
 
 @dataclass
@@ -14,6 +30,9 @@ class Curve(Parameterized):
         default=1,
     )
 
+    # The float type for computed samples.  np.float32 halves the memory.
+    dtype = np.float64
+
     def __init__(self):
         super().__init__(name="")
         self.algorithm = self.ALGORITHM
@@ -25,19 +44,144 @@ class Curve(Parameterized):
 
     @classmethod
     def any_from_params(cls, params):
-        alg = int(params.pop("alg", 1))
-        subcls = cls.subcurves[alg]
-        return subcls.from_params(params)
+        with timed("parse"):
+            alg = int(params.pop("alg", 1))
+            subcls = cls.subcurves[alg]
+            return subcls.from_params(params)
 
     def complexity(self):
         return 0
 
-    def points(self, dims, dt=0.01):
-        pass
+    def points(self, dims, scale, dt=0.01):
+        """
+        Produce a tuple of values for each sample of the `dims` dimensions.
+
+        This is a thin wrapper around `samples` for callers that want to
+        iterate point by point.
+        """
+        yield from zip(*self.samples(dims, scale, dt).T)
+
+    def samples(self, dims, scale, dt=0.01, max_error=None):
+        """
+        Compute the curve as an N×D float array, one column per name in `dims`.
+
+        If `max_error` is provided, samples are placed adaptively so that lines
+        between them are within `max_error` of the curve at this `scale`.
+        `dt` is then the smallest step to take.
+        """
+        tolerance = unit_tolerance(max_error, scale)
+        with timed("samples"):
+            key = self.cache_key()
+            if key is None:
+                unit = self.compute_samples(dims, dt, tolerance)
+            else:
+                unit = sample_cache.get_or_compute(
+                    (key, tuple(dims), dt, tolerance, np.dtype(self.dtype).str),
+                    lambda: self.compute_samples(dims, dt, tolerance),
+                )
+            return unit * scale
+
+    def compute_samples(self, dims, dt, tolerance=None):
+        """
+        Compute the samples for `samples`, at a scale of 1.
+        """
+        return self.evaluate(dims, self.sample_times(dt, tolerance))
+
+    def iter_samples(self, dims, scale, dt=0.01, max_error=None, chunk=STREAM_CHUNK):
+        """
+        Compute the curve a piece at a time, producing arrays like `samples`.
+
+        Each piece covers `chunk` time steps, and starts with the last point of
+        the piece before it, so drawing them one after another leaves no gaps.
+        Nothing is cached, so no more than one piece is in memory at once.
+        """
+        start, step, count = self.time_grid(dt)
+        tolerance = unit_tolerance(max_error, scale)
+        for lo in range(0, count - 1, chunk):
+            check_deadline()
+            hi = min(lo + chunk, count - 1)
+            with timed("samples"):
+                if tolerance is None:
+                    t = start + step * np.arange(lo, hi + 1)
+                else:
+                    t = adaptive_times(
+                        lambda t: self.evaluate(["x", "y"], t),
+                        start + step * lo,
+                        start + step * hi,
+                        max_step=self.max_time_step(),
+                        min_step=step,
+                        tolerance=tolerance,
+                    )
+                pts = self.evaluate(dims, t) * scale
+            yield pts
+
+    def sample_times(self, dt, tolerance=None):
+        """
+        Choose the times to sample: evenly spaced, or adaptively if
+        `tolerance` is provided.
+        """
+        start, step, count = self.time_grid(dt)
+        if tolerance is None:
+            return start + step * np.arange(count)
+        return adaptive_times(
+            lambda t: self.evaluate(["x", "y"], t),
+            start,
+            start + step * (count - 1),
+            max_step=self.max_time_step(),
+            min_step=step,
+            tolerance=tolerance,
+        )
+
+    def time_grid(self, dt):
+        """
+        The evenly spaced sample times as (start, step, count).
+        """
+        raise NotImplementedError
+
+    def sample_count(self, dt):
+        """
+        How many samples will be computed at `dt`, at most.
+        """
+        return self.time_grid(dt)[2]
+
+    def max_time_step(self):
+        """
+        The largest time step that can't skip over a feature of the curve.
+        """
+        raise NotImplementedError
+
+    def evaluate(self, dims, t):
+        """
+        Compute an N×D array of the `dims` dimensions at times `t`, at a scale
+        of 1.
+        """
+        raise NotImplementedError
+
+    def cache_key(self):
+        """
+        A hashable key identifying the shape of this curve, or None if its
+        samples shouldn't be cached.
+        """
+        return tuple(sorted(self.short_parameters().items()))
 
     def draw_more(self, ctx):
         pass
 
 
+def unit_tolerance(max_error, scale):
+    """
+    The error allowed at a scale of 1, for `max_error` at `scale`, or None.
+
+    The scale is rounded up to a power of two times the scale of a full-size
+    image, so that all the sizes in an octave share one set of cached samples,
+    at worst twice as fine as needed.  Full-size images and their halvings and
+    doublings get exactly the tolerance they ask for.
+    """
+    if max_error is None:
+        return None
+    full = FULLY / 2
+    return max_error / (full * 2 ** math.ceil(math.log2(scale / full)))
+
+
 class ImpossibleCurve(Exception):
     ...
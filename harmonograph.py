@@ -3,6 +3,7 @@ from dataclasses import dataclass
 
 import numpy as np
 
+from budget import check_deadline
 from curve import Curve
 from render import ColorLine, ElegantLine
 from parameter import GlobalParameter, Parameter, Parameterized, global_value
@@ -62,6 +63,43 @@ class FullWave(Parameterized):
             return super().make_random(name, rnd)
 
 
+# Samples are computed this many at a time, to bound the memory needed for
+# intermediate results no matter how wide the time span is.
+CHUNK = 20_000
+
+
+class WaveBank:
+    """
+    A number of FullWaves packed into arrays, to evaluate their sum at once.
+    """
+
+    def __init__(self, waves, density=1, scale=1.0, dtype=np.float64):
+        self.amp = np.array([wave.amp * scale for wave in waves], dtype=dtype)
+        # Column vectors, so they broadcast against a row of times, even when
+        # there are no waves.
+        self.rate = np.array(
+            [wave.freq * density + wave.tweq for wave in waves], dtype=float
+        ).reshape(-1, 1)
+        self.phase = np.array(
+            [wave.phase for wave in waves], dtype=float
+        ).reshape(-1, 1)
+        self.scratch = np.empty((len(waves), CHUNK))
+
+    def evaluate(self, t, out):
+        """
+        Write the sum of the waves at times `t` into the array `out`.
+
+        `t` can be at most CHUNK long.
+        """
+        # The angles are always float64: they get large, and float32 would
+        # lose too much precision.
+        angles = self.scratch[:, :len(t)]
+        np.multiply(self.rate, t, out=angles)
+        angles += self.phase
+        np.sin(angles, out=angles)
+        np.dot(self.amp, angles.astype(self.amp.dtype, copy=False), out=out)
+
+
 @dataclass
 class Ramp(Parameterized):
     stop: Parameter(
@@ -136,26 +174,45 @@ class Harmonograph(Curve):
     def set_time_span(self, timespan):
         self.timespan = timespan
 
-    def points(self, dims, scale, dt=0.01):
+    def time_grid(self, dt):
+        """
+        The sample times as (start, step, count), like np.arange would make.
+        """
         ts_half = self.timespan.width // 2
-        t = np.arange(
-            start=self.timespan.center - ts_half,
-            stop=self.timespan.center + ts_half,
-            step=dt / self.density,
+        start = self.timespan.center - ts_half
+        stop = self.timespan.center + ts_half
+        step = dt / self.density
+        return start, step, max(math.ceil((stop - start) / step), 0)
+
+    def max_time_step(self):
+        fastest = max(
+            (
+                abs(wave.freq * self.density + wave.tweq)
+                for dim_name in ["x", "y"]
+                for wave in self.dimensions[dim_name]
+            ),
+            default=0,
         )
-        scale *= 2
-        scale /= len(self.dimensions["x"]) + 1
-        pts = []
-        for dim_name in dims:
-            waves = self.dimensions[dim_name]
-            val = 0.0
-            for wave in waves:
-                val += wave(t, self.density)
-            val *= self.ramp(t)
-            val *= scale
-            pts.append(val)
-        for pt in zip(*pts):
-            yield pt
+        # An eighth of a turn of the fastest wave.
+        return (math.pi / 4) / max(fastest, 1e-6)
+
+    def evaluate(self, dims, t):
+        scale = 2 / (len(self.dimensions["x"]) + 1)
+        # Each dimension is a contiguous row, the transpose is N×D.
+        pts = np.empty((len(dims), len(t)), dtype=self.dtype)
+        banks = [
+            WaveBank(self.dimensions[dim_name], self.density, scale, self.dtype)
+            for dim_name in dims
+        ]
+        for lo in range(0, len(t), CHUNK):
+            check_deadline()
+            tc = t[lo:lo + CHUNK]
+            ramp = self.ramp(tc)
+            for idim, bank in enumerate(banks):
+                out = pts[idim, lo:lo + len(tc)]
+                bank.evaluate(tc, out)
+                out *= ramp
+        return pts.T
 
     def param_things(self):
         for dim_name, dim in self.dimensions.items():
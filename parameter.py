@@ -5,6 +5,7 @@ Parameterized curves
 import contextlib
 import contextvars
 import dataclasses
+import functools
 from dataclasses import dataclass
 
 
@@ -70,6 +71,36 @@ class Parameter:
         else:
             return int(s)
 
+    def compiled_to_short(self):
+        """
+        Get a function that does what `to_short` does, as quickly as possible.
+        """
+        if "to_short" in vars(self) or not isinstance(self.default, float):
+            return self.to_short
+        scale = self.scale
+        factor = 10**self.places
+
+        def to_short(v):
+            return str(int(v / scale * factor))
+
+        return to_short
+
+    def compiled_from_short(self):
+        """
+        Get a function that does what `from_short` does, as quickly as possible.
+        """
+        if "from_short" in vars(self):
+            return self.from_short
+        if not isinstance(self.default, float):
+            return int
+        scale = self.scale
+        divisor = 10**self.places
+
+        def from_short(s):
+            return float(s) / divisor * scale
+
+        return from_short
+
     def repr(self, v):
         if isinstance(self.default, float):
             return format(v, f".{self.places}f")
@@ -88,13 +119,47 @@ class Parameterized:
     name: str
 
     @classmethod
+    @functools.lru_cache(maxsize=None)
     def paramdefs(cls):
         """
         Get the fields that are Parameters.
         """
-        for field in dataclasses.fields(cls):
-            if isinstance(field.type, Parameter):
-                yield field
+        return tuple(
+            field
+            for field in dataclasses.fields(cls)
+            if isinstance(field.type, Parameter)
+        )
+
+    # Converting to and from short parameters happens many times for every
+    # request, so the per-field work is done once for each class and name.
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _from_short_schema(cls, name):
+        """
+        Get (attribute, key, from_short, default) for each Parameter.
+        """
+        return tuple(
+            (
+                field.name,
+                name + field.type.key,
+                field.type.compiled_from_short(),
+                field.type.default,
+            )
+            for field in cls.paramdefs()
+            if field.name != "algorithm"  # TODO: do this the right way!!!
+        )
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _to_short_schema(cls, name):
+        """
+        Get (key, attribute, to_short) for each Parameter.
+        """
+        return tuple(
+            (name + field.type.key, field.name, field.type.compiled_to_short())
+            for field in cls.paramdefs()
+        )
 
     @classmethod
     def make_random(cls, name, rnd):
@@ -116,14 +181,11 @@ class Parameterized:
         Make an instance using the params dict for Parameter short values.
         """
         kwargs = {}
-        for field in cls.paramdefs():
-            key = name + field.type.key
+        for attr, key, from_short, default in cls._from_short_schema(name):
             if key in params:
-                val = field.type.from_short(params[key])
+                kwargs[attr] = from_short(params[key])
             else:
-                val = field.type.default
-            if field.name != "algorithm":  # TODO: do this the right way!!!
-                kwargs[field.name] = val
+                kwargs[attr] = default
         if name:
             kwargs["name"] = name
         return cls(**kwargs)
@@ -146,12 +208,8 @@ class Parameterized:
         """
         shorts = {}
         for thing, _ in self.param_things():
-            for field in thing.paramdefs():
-                key = thing.name + field.type.key
-                val = getattr(thing, field.name)
-                if field.type.to_short:
-                    val = field.type.to_short(val)
-                shorts[key] = str(val)
+            for key, attr, to_short in thing._to_short_schema(thing.name):
+                shorts[key] = str(to_short(getattr(thing, attr)))
         return shorts
 
 
@@ -0,0 +1,243 @@
+"""
+Reading and writing PNG files at the chunk level.
+
+https://www.w3.org/TR/png/ describes the format: a signature, then chunks,
+each a length, a four-byte type, the data, and a CRC of the type and data.
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+TEXT_CHUNKS = {b"tEXt", b"zTXt", b"iTXt"}
+
+
+def make_chunk(ctype, data):
+    """
+    Make the bytes of a chunk of type `ctype` holding `data`.
+    """
+    return (
+        struct.pack(">I", len(data))
+        + ctype
+        + data
+        + struct.pack(">I", zlib.crc32(ctype + data))
+    )
+
+
+def text_chunk(key, value):
+    """
+    Make a text chunk: tEXt if `value` can be Latin-1, or iTXt if not.
+    """
+    keyword = key.encode("latin-1")
+    try:
+        return make_chunk(b"tEXt", keyword + b"\0" + value.encode("latin-1"))
+    except UnicodeEncodeError:
+        # No compression, no language tag, no translated keyword.
+        return make_chunk(b"iTXt", keyword + b"\0\0\0\0\0" + value.encode("utf-8"))
+
+
+def add_text(png_bytes, texts):
+    """
+    Add text chunks to the bytes of a PNG, without touching the image data.
+
+    `texts` is a dict of keywords and values.  The chunks go right after the
+    IHDR chunk, so readers find them before the image data.
+    """
+    if not png_bytes.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG file")
+    # IHDR must be first: 8 bytes of length and type, its data, 4 bytes of CRC.
+    (ihdr_len,) = struct.unpack(">I", png_bytes[8:12])
+    ihdr_end = 8 + 8 + ihdr_len + 4
+    chunks = b"".join(text_chunk(key, value) for key, value in texts.items())
+    return png_bytes[:ihdr_end] + chunks + png_bytes[ihdr_end:]
+
+
+class PngWriter:
+    """
+    Write an 8-bit RGB PNG to the file object `f` a band of rows at a time,
+    so the whole image never has to be in memory.
+    """
+
+    # Compressed image data is written in chunks of about this size.
+    IDAT_SIZE = 1_000_000
+
+    def __init__(self, f, size, texts=None):
+        self.f = f
+        self.width, self.height = size
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(6)
+        self.pending = []
+        self.npending = 0
+        f.write(PNG_SIGNATURE)
+        # Bit depth 8, color type 2 (RGB), deflate, adaptive filtering, no
+        # interlacing.
+        ihdr = struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0)
+        f.write(make_chunk(b"IHDR", ihdr))
+        for key, value in (texts or {}).items():
+            f.write(text_chunk(key, value))
+
+    def write_rows(self, rows):
+        """
+        Write rows of pixels, from an H×W×3 uint8 array.
+        """
+        assert rows.shape[1:] == (self.width, 3)
+        # The Sub filter stores each byte as the difference from the same
+        # channel of the pixel to its left, which is mostly zeros for our
+        # images, and compresses well.
+        rows = rows.reshape(len(rows), -1)
+        filtered = np.empty((len(rows), rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 1
+        filtered[:, 1:4] = rows[:, :3]
+        np.subtract(rows[:, 3:], rows[:, :-3], out=filtered[:, 4:])
+        self._add_data(self.compressor.compress(filtered.tobytes()))
+        self.rows_written += len(rows)
+
+    def _add_data(self, data):
+        self.pending.append(data)
+        self.npending += len(data)
+        if self.npending >= self.IDAT_SIZE:
+            self._flush_data()
+
+    def _flush_data(self):
+        if self.npending:
+            self.f.write(make_chunk(b"IDAT", b"".join(self.pending)))
+        self.pending = []
+        self.npending = 0
+
+    def close(self):
+        """
+        Finish the PNG, once all the rows have been written.
+        """
+        assert self.rows_written == self.height
+        self._add_data(self.compressor.flush())
+        self._flush_data()
+        self.f.write(make_chunk(b"IEND", b""))
+
+
+def read_chunks(f, wanted=None, stop=None):
+    """
+    Read chunks from the PNG file object `f`, producing (type, data) pairs.
+
+    If `wanted` is a set of chunk types, other chunks are produced with None
+    as their data, and skipped without being checked.  If `stop` is a set of
+    chunk types, reading ends at the first of them, without reading it.
+    """
+    if f.read(8) != PNG_SIGNATURE:
+        raise ValueError("Not a PNG file")
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError("Truncated PNG file")
+        length, ctype = struct.unpack(">I4s", header)
+        if stop is not None and ctype in stop:
+            break
+        if wanted is not None and ctype not in wanted:
+            skip(f, length + 4)
+            yield ctype, None
+        else:
+            data = f.read(length)
+            crc = f.read(4)
+            if len(data) < length or len(crc) < 4:
+                raise ValueError("Truncated PNG file")
+            if struct.unpack(">I", crc)[0] != zlib.crc32(ctype + data):
+                raise ValueError(f"Bad CRC in {ctype!r} chunk")
+            yield ctype, data
+        if ctype == b"IEND":
+            break
+
+
+def skip(f, nbytes):
+    """
+    Skip `nbytes` ahead in `f`, seeking if we can.
+    """
+    if f.seekable():
+        f.seek(nbytes, 1)
+    else:
+        while nbytes > 0:
+            got = len(f.read(min(nbytes, 64 * 1024)))
+            if not got:
+                raise ValueError("Truncated PNG file")
+            nbytes -= got
+
+
+def parse_text(ctype, data):
+    """
+    Get (keyword, value) from the data of a tEXt, zTXt or iTXt chunk.
+    """
+    keyword, _, rest = data.partition(b"\0")
+    key = keyword.decode("latin-1")
+    if ctype == b"tEXt":
+        return key, rest.decode("latin-1")
+    elif ctype == b"zTXt":
+        return key, zlib.decompress(rest[1:]).decode("latin-1")
+    else:
+        compressed, _method = rest[0], rest[1]
+        _language, _, rest = rest[2:].partition(b"\0")
+        _translated, _, text = rest.partition(b"\0")
+        if compressed:
+            text = zlib.decompress(text)
+        return key, text.decode("utf-8")
+
+
+class LimitedReader:
+    """
+    Wrap a file object so that reading or seeking more than `max_bytes`
+    through it raises ValueError, before the bytes are read.
+    """
+
+    def __init__(self, f, max_bytes):
+        self.f = f
+        self.remaining = max_bytes
+
+    def _use(self, nbytes):
+        self.remaining -= nbytes
+        if self.remaining < 0:
+            raise ValueError("PNG file is too large")
+
+    def read(self, nbytes):
+        self._use(nbytes)
+        return self.f.read(nbytes)
+
+    def seekable(self):
+        return self.f.seekable()
+
+    def seek(self, offset, whence):
+        assert whence == 1, "Only relative seeks are supported"
+        self._use(offset)
+        return self.f.seek(offset, whence)
+
+
+def find_text(f, key, max_bytes=None):
+    """
+    Find the value of the text chunk with keyword `key` in the PNG file
+    object `f`, or None if there isn't one.
+
+    Reading stops as soon as the chunk is found, or at the image data, since
+    the text we write comes before it.  If `max_bytes` is given, ValueError is
+    raised rather than read more than that.
+    """
+    if max_bytes is not None:
+        f = LimitedReader(f, max_bytes)
+    prefix = key.encode("latin-1") + b"\0"
+    for ctype, data in read_chunks(f, wanted=TEXT_CHUNKS, stop={b"IDAT"}):
+        # Only decode (and maybe decompress) the chunk we're looking for.
+        if data is not None and data.startswith(prefix):
+            return parse_text(ctype, data)[1]
+    return None
+
+
+def read_text(f):
+    """
+    Read all the text chunks from the PNG file object `f` as a dict.
+
+    The image data is skipped, not decoded.
+    """
+    texts = {}
+    for ctype, data in read_chunks(f, wanted=TEXT_CHUNKS):
+        if data is not None:
+            key, value = parse_text(ctype, data)
+            texts[key] = value
+    return texts
@@ -0,0 +1,81 @@
+"""
+Drawing images too big to hold in memory, one tile at a time.
+"""
+
+import multiprocessing
+
+import cairo
+import numpy as np
+
+from curve import Curve
+from pngio import PngWriter
+from render import png_texts
+from util import dict_to_slug, slug_to_dict
+
+from harmonograph import Harmonograph
+from spirograph import Spirograph
+
+# Tiles are this many pixels on a side.
+TILE_SIZE = 1024
+
+
+def draw_poster(curve, size, output, tile_size=TILE_SIZE, jobs=1):
+    """
+    Draw `curve` as a PNG of `size`, writing it to the file object `output`.
+
+    The image is drawn in tiles, a band of them at a time, and each band is
+    written to the PNG before the next is drawn, so memory use depends on
+    the width of the image but not its height.  With more than one job,
+    tiles are drawn in parallel, and the next band is drawn while the last
+    one is being compressed.
+    """
+    width, height = size
+    slug = dict_to_slug(curve.short_parameters())
+    bands = []
+    for y in range(0, height, tile_size):
+        h = min(tile_size, height - y)
+        bands.append(
+            [
+                (slug, size, (x, y, min(tile_size, width - x), h))
+                for x in range(0, width, tile_size)
+            ]
+        )
+    writer = PngWriter(output, size, texts=png_texts(curve))
+    if jobs == 1:
+        for band in bands:
+            writer.write_rows(join_tiles([draw_tile(tile) for tile in band]))
+    else:
+        with multiprocessing.Pool(jobs) as pool:
+            pending = pool.map_async(draw_tile, bands[0])
+            for next_band in bands[1:] + [None]:
+                tiles = pending.get()
+                if next_band is not None:
+                    pending = pool.map_async(draw_tile, next_band)
+                writer.write_rows(join_tiles(tiles))
+    writer.close()
+
+
+def draw_tile(tile):
+    """
+    Draw one tile of a poster, returning its pixels as an H×W×3 array.
+
+    `tile` is (slug, size, (x, y, w, h)): the curve, the size of the whole
+    image, and the part of it to draw.
+    """
+    slug, size, (x, y, w, h) = tile
+    curve = Curve.any_from_params(slug_to_dict(slug))
+    with cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h) as surface:
+        curve.render.draw(surface, size, curve, origin=(-x, -y))
+        surface.flush()
+        data = np.frombuffer(surface.get_data(), dtype=np.uint8)
+        # Cairo's pixels are native-endian 32-bit words, so BGRA in memory
+        # on the little-endian machines we run on.
+        pixels = data.reshape(h, surface.get_stride() // 4, 4)[:, :w]
+        return pixels[:, :, 2::-1].copy()
+
+
+def join_tiles(tiles):
+    """
+    Put a band of tiles side by side into one array.
+    """
+    return np.concatenate(tiles, axis=1)
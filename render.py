@@ -1,42 +1,132 @@
-import colorsys
+import collections
+import functools
+import hashlib
+import itertools
 import json
+import os
+from dataclasses import dataclass
 from io import BytesIO
 
 import cairo
-from PIL import Image, PngImagePlugin
+import numpy as np
+from PIL import Image
 
-from constants import PNG_STATE_KEY
+from budget import check_deadline
+from constants import PNG_STATE_KEY, RENDER_VERSION
+from pngio import add_text
+from svg import (
+    format_numbers,
+    iter_svg_path,
+    svg_end,
+    svg_gray,
+    svg_rect,
+    svg_start,
+)
+from timing import timed
 
 
 class Render:
     extras = []
     DTS = [(400, 0.02), (1000, 0.01), (9999999, 0.001)]
+    # If set, curves are sampled adaptively to keep lines within this many
+    # pixels of the true curve, and the DTS value is the smallest step.
+    max_error = None
+    # If set, a Simplification applied to the samples before drawing them.
+    simplify = None
 
     def __init__(self, linewidth=5, alpha=1, bg=1):
         self.linewidth = linewidth
         self.alpha = alpha
         self.bg = bg
 
-    def draw(self, surface, size, curve, with_more=False):
+    def draw(
+        self, surface, size, curve, with_more=False, origin=None, simplify=None
+    ):
+        """
+        Draw `curve` on `surface`, filling a rectangle of `size`.
+
+        If `origin` is provided, the rectangle starts there on the surface,
+        and drawing is clipped to it.  If `simplify` is provided, it's used to
+        thin out the samples of single-line renders before they are drawn.
+        """
+        self.simplify = simplify
+        with timed("draw"):
+            ctx = self.begin(surface, size, origin)
+            maxsize = min(self.width, self.height) / 2
+            self.draw_curve(ctx, curve, scale=maxsize)
+            if with_more:
+                curve.draw_more(ctx, scale=maxsize, param=with_more)
+
+    def begin(self, surface, size, origin=None):
+        """
+        Get ready to draw on `surface`: fill the background, and return a
+        context with (0, 0) in the center and y going up.
+        """
         self.surface = surface
         self.width, self.height = size
         self.dt = lookup(self.width, self.DTS)
         ctx = cairo.Context(surface)
+        if origin is not None:
+            ctx.translate(*origin)
+            ctx.rectangle(0, 0, self.width, self.height)
+            ctx.clip()
         ctx.rectangle(0, 0, self.width, self.height)
         ctx.set_source_rgba(self.bg, self.bg, self.bg, 1)
         ctx.fill()
-        ctx.translate(self.width / 2, self.height / 2)
-        ctx.scale(1, -1)
+        self.center(ctx)
         self.set_line_width(ctx, 1)
+        self.view = None
+        if origin is not None and isinstance(surface, cairo.ImageSurface):
+            # Drawing a tile of a larger image: note what part of the image
+            # this surface shows, so segments outside of it can be skipped.
+            corners = [
+                ctx.device_to_user(x, y)
+                for x in [0, surface.get_width()]
+                for y in [0, surface.get_height()]
+            ]
+            xs, ys = zip(*corners)
+            self.view = (min(xs), min(ys), max(xs), max(ys))
+        return ctx
 
-        maxsize = min(self.width, self.height) / 2
-        self.draw_curve(ctx, curve, scale=maxsize)
-        if with_more:
-            curve.draw_more(ctx, scale=maxsize, param=with_more)
+    def center(self, ctx):
+        """
+        Move (0, 0) to the center of the image, with y going up.
+        """
+        ctx.translate(self.width / 2, self.height / 2)
+        ctx.scale(1, -1)
 
     def set_line_width(self, ctx, width_tweak):
         ctx.set_line_width(self.width * self.linewidth * width_tweak / 10000)
 
+    def visible_segments(self, pts, line_width):
+        """
+        Find the segments between `pts` that could show on the surface.
+
+        Returns a bool array with an entry for each segment, or None if we
+        aren't drawing a tile, and every segment should be drawn.
+        """
+        if self.view is None:
+            return None
+        # Miter joins can stick out as far as 10 line widths.
+        margin = line_width * 10
+        xmin, ymin, xmax, ymax = self.view
+        x0, y0 = pts[:-1, 0], pts[:-1, 1]
+        x1, y1 = pts[1:, 0], pts[1:, 1]
+        return (
+            (np.maximum(x0, x1) >= xmin - margin)
+            & (np.minimum(x0, x1) <= xmax + margin)
+            & (np.maximum(y0, y1) >= ymin - margin)
+            & (np.minimum(y0, y1) <= ymax + margin)
+        )
+
+    def simplified(self, pts):
+        """
+        Apply the simplification for this drawing, if any, to `pts`.
+        """
+        if self.simplify is None:
+            return pts
+        return self.simplify(pts)
+
 
 def lookup(x, choices):
     """
@@ -47,7 +137,90 @@ def lookup(x, choices):
             return choice
 
 
+# The modules whose code decides what images look like.
+DRAWING_MODULES = [
+    "budget.py",
+    "curve.py",
+    "harmonograph.py",
+    "parameter.py",
+    "pngio.py",
+    "render.py",
+    "sampling.py",
+    "simplify.py",
+    "spirograph.py",
+    "svg.py",
+]
+
+
+@functools.lru_cache(maxsize=None)
+def drawing_version():
+    """
+    A string that changes whenever images might be drawn differently.
+
+    It's a hash of RENDER_VERSION, the source of DRAWING_MODULES, and the
+    versions of the libraries that draw and encode, so cached images are
+    never served by code that would draw them differently.
+    """
+    sha = hashlib.sha256()
+    sha.update(repr(RENDER_VERSION).encode("ascii"))
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in DRAWING_MODULES:
+        with open(os.path.join(here, name), "rb") as f:
+            sha.update(f.read())
+    for version in [cairo.cairo_version_string(), np.__version__, Image.__version__]:
+        sha.update(version.encode("ascii"))
+    return sha.hexdigest()[:16]
+
+
+def estimated_samples(curve, size, render=None):
+    """
+    How many samples drawing `curve` at `size` will compute, at most.
+    """
+    if render is None:
+        render = curve.render
+    return curve.sample_count(lookup(size[0], render.DTS))
+
+
+# Long paths are built this many points at a time, checking the deadline
+# in between.
+POLYLINE_CHUNK = 50_000
+
+
+def add_polyline(ctx, pts):
+    """
+    Add a polyline to the current path from an N×2 array of points.
+    """
+    if len(pts) == 0:
+        return
+    # Converting to a list once and letting starmap drive line_to keeps the
+    # per-point work in C instead of unboxing NumPy scalars one at a time.
+    xys = pts.tolist()
+    ctx.move_to(*xys[0])
+    for i in range(1, len(xys), POLYLINE_CHUNK):
+        check_deadline()
+        chunk = xys[i:i + POLYLINE_CHUNK]
+        collections.deque(itertools.starmap(ctx.line_to, chunk), maxlen=0)
+
+
+def visible_runs(pts, visible):
+    """
+    Split `pts` into the runs of points joined by visible segments.
+
+    `visible` has an entry for each segment, from point i to point i+1.
+    """
+    # Runs start where a visible segment follows an invisible one, and end
+    # where an invisible one follows a visible one.
+    edges = np.diff(visible.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return [pts[start:end + 1] for start, end in zip(starts, ends)]
+
+
 class ElegantLine(Render):
+    max_error = 0.25
+    # Curves at least this complex are drawn a piece at a time.
+    stream_complexity = 25_000
+
     def __init__(self, gray=0, **kwargs):
         super().__init__(**kwargs)
         self.gray = gray
@@ -56,24 +229,88 @@ class ElegantLine(Render):
         assert self.alpha == 1
 
     def draw_curve(self, ctx, curve, scale):
-        if curve.complexity() < 25_000:
-            ctx.set_source_rgb(self.gray, self.gray, self.gray)
-            for i, (x, y) in enumerate(curve.points(["x", "y"], scale=scale, dt=self.dt)):
-                if i == 0:
-                    ctx.move_to(x, y)
-                else:
-                    ctx.line_to(x, y)
-            ctx.stroke()
+        ctx.set_source_rgb(self.gray, self.gray, self.gray)
+        if curve.complexity() < self.stream_complexity:
+            pts = curve.samples(
+                ["x", "y"], scale=scale, dt=self.dt, max_error=self.max_error
+            )
+            self.stroke_points(ctx, pts)
+        else:
+            # Round joins and caps make the seams between pieces invisible.
+            ctx.set_line_join(cairo.LINE_JOIN_ROUND)
+            ctx.set_line_cap(cairo.LINE_CAP_ROUND)
+            for pts in curve.iter_samples(
+                ["x", "y"], scale=scale, dt=self.dt, max_error=self.max_error
+            ):
+                self.stroke_points(ctx, pts)
+
+    def stroke_points(self, ctx, pts):
+        """
+        Stroke a polyline through `pts`.
+        """
+        pts = self.simplified(pts)
+        visible = self.visible_segments(pts, ctx.get_line_width())
+        if visible is None:
+            add_polyline(ctx, pts)
         else:
-            ctx.set_source_rgb(0.75, 0.75, 0.75)
-            w = scale * 0.25
-            ctx.move_to(-w, -w)
-            ctx.line_to(-w, w)
-            ctx.line_to(w, w)
-            ctx.line_to(w, -w)
-            ctx.close_path()
-            ctx.fill()
+            for run in visible_runs(pts, visible):
+                add_polyline(ctx, run)
+        ctx.stroke()
 
+    def iter_svg(self, curve, size, simplify=None, relative=False, decimals=2):
+        """
+        Produce the same picture as `draw` onto an SVG surface would, as
+        chunks of SVG text, without going through cairo.
+        """
+        self.simplify = simplify
+        self.width, self.height = size
+        self.dt = lookup(self.width, self.DTS)
+        scale = min(self.width, self.height) / 2
+        yield svg_start(size)
+        yield svg_rect(size, self.bg)
+        line_width = format_numbers(self.width * self.linewidth / 10000, 4)
+        style = f"fill:none;stroke:{svg_gray(self.gray)};stroke-width:{line_width};"
+        if curve.complexity() < self.stream_complexity:
+            pieces = [
+                curve.samples(
+                    ["x", "y"], scale=scale, dt=self.dt, max_error=self.max_error
+                )
+            ]
+            style += "stroke-linecap:butt;stroke-linejoin:miter;stroke-miterlimit:10;"
+        else:
+            # A path for each piece, as in draw_curve.
+            pieces = curve.iter_samples(
+                ["x", "y"], scale=scale, dt=self.dt, max_error=self.max_error
+            )
+            style += "stroke-linecap:round;stroke-linejoin:round;"
+        for pts in pieces:
+            # Image coordinates have (0, 0) at the top left, with y going down.
+            pts = self.simplified(pts) * [1, -1] + [self.width / 2, self.height / 2]
+            yield from iter_svg_path(pts, style, relative=relative, decimals=decimals)
+        yield svg_end()
+
+
+class Placeholder(Render):
+    """
+    Draws a gray square instead of the curve, for when it's too expensive.
+    """
+
+    def draw_curve(self, ctx, curve, scale):
+        draw_placeholder(ctx, scale)
+
+
+def draw_placeholder(ctx, scale):
+    """
+    Draw a gray square in the middle of the image.
+    """
+    ctx.set_source_rgb(0.75, 0.75, 0.75)
+    w = scale * 0.25
+    ctx.move_to(-w, -w)
+    ctx.line_to(-w, w)
+    ctx.line_to(w, w)
+    ctx.line_to(w, -w)
+    ctx.close_path()
+    ctx.fill()
 
 
 class ColorLine(Render):
@@ -84,48 +321,205 @@ class ColorLine(Render):
         self.lightness = lightness
 
     def draw_curve(self, ctx, curve, scale):
-        x0 = y0 = 0
-        for i, (x, y, hue, width_tweak) in enumerate(
-            curve.points(["x", "y", "j", "k"], scale=scale, dt=self.dt)
-        ):
-            if i > 0:
-                r, g, b = colorsys.hls_to_rgb(hue, self.lightness, 1)
-                ctx.set_source_rgba(r, g, b, self.alpha)
+        # No simplifying: it only looks at x and y, but every point has its own
+        # color and width.
+        pts = curve.samples(["x", "y", "j", "k"], scale=scale, dt=self.dt)
+        if len(pts) < 2:
+            return
+        max_width = self.width * self.linewidth * (pts[:, 3].max() / 100 + 1.5) / 10000
+        visible = self.visible_segments(pts, max_width)
+        self.draw_segments(ctx, pts, visible)
+
+    def draw_segments(self, ctx, pts, visible=None):
+        """
+        Stroke each segment separately, with its own color and width.
+
+        Segment i goes from point i to point i+1, and is colored by point i+1.
+        If `visible` is given, only the segments marked True are drawn.
+        """
+        # Everything but the cairo calls is computed for all the segments at
+        # once, as columns: x0, y0, x1, y1, r, g, b, width.
+        tweaks = pts[1:, 3] / 100 + 1.5
+        columns = np.column_stack(
+            [
+                pts[:-1, :2],
+                pts[1:, :2],
+                hls_to_rgb(pts[1:, 2], self.lightness, 1),
+                self.width * self.linewidth * tweaks / 10000,
+            ]
+        )
+        if visible is not None:
+            columns = columns[visible]
+        alpha = self.alpha
+        for lo in range(0, len(columns), POLYLINE_CHUNK):
+            check_deadline()
+            chunk = columns[lo:lo + POLYLINE_CHUNK].T.tolist()
+            for x0, y0, x1, y1, r, g, b, width in zip(*chunk):
+                ctx.set_source_rgba(r, g, b, alpha)
                 ctx.move_to(x0, y0)
-                ctx.line_to(x, y)
-                self.set_line_width(ctx, width_tweak/100 + 1.5)
+                ctx.line_to(x1, y1)
+                ctx.set_line_width(width)
                 ctx.stroke()
-            x0, y0 = x, y
 
 
-def draw_svg(curve, size, render=None):
+def hls_to_rgb(h, l, s):
+    """
+    Like colorsys.hls_to_rgb, but for an array of hues.
+
+    Returns an array of shape (len(h), 3).
+    """
+    if l <= 0.5:
+        m2 = l * (1.0 + s)
+    else:
+        m2 = l + s - (l * s)
+    m1 = 2.0 * l - m2
+    r = _hue_value(m1, m2, h + 1/3)
+    g = _hue_value(m1, m2, h)
+    b = _hue_value(m1, m2, h - 1/3)
+    return np.stack([r, g, b], axis=-1)
+
+
+def _hue_value(m1, m2, hue):
+    hue = hue % 1.0
+    return np.select(
+        [hue < 1/6, hue < 0.5, hue < 2/3],
+        [m1 + (m2 - m1) * hue * 6.0, m2, m1 + (m2 - m1) * (2/3 - hue) * 6.0],
+        m1,
+    )
+
+
+def draw_svg(curve, size, render=None, simplify=None, relative=False):
+    """
+    Draw `curve` as SVG text.
+
+    The whole document is built in memory: use `write_svg` to write a large
+    SVG to a file without holding all of it.
+    """
+    svgio = BytesIO()
+    write_svg(curve, size, svgio, render=render, simplify=simplify, relative=relative)
+    return svgio.getvalue().decode("ascii")
+
+
+def write_svg(curve, size, output, render=None, simplify=None, relative=False):
+    """
+    Draw `curve` as SVG, writing it to the binary file object `output`.
+
+    Single-line renders write the SVG themselves a chunk at a time, with
+    `relative` choosing relative path moves.  Others are drawn on a cairo SVG
+    surface, which writes to `output` as it goes.
+    """
     width, height = size
     if render is None:
         render = curve.render
-    svgio = BytesIO()
-    with cairo.SVGSurface(svgio, width, height) as surface:
+    if isinstance(render, ElegantLine):
+        with timed("draw"):
+            chunks = render.iter_svg(curve, size, simplify=simplify, relative=relative)
+            for chunk in chunks:
+                output.write(chunk.encode("ascii"))
+        return
+    with cairo.SVGSurface(output, width, height) as surface:
         surface.set_document_unit(cairo.SVGUnit.PX)
-        render.draw(surface, size, curve)
-    return svgio.getvalue().decode("ascii")
+        render.draw(surface, size, curve, simplify=simplify)
 
 
-def draw_png(curve, size, render=None, with_metadata=False, with_more=0):
+@dataclass(frozen=True)
+class Encoding:
+    """
+    How to encode a rendered image into bytes.
+    """
+
+    # "png" or "webp".
+    format: str = "png"
+    # For PNG: quantize to a palette of this many colors, or 0 for full color.
+    palette: int = 0
+    # For PNG: the zlib compression level, or None for cairo's own encoder.
+    compress_level: int = None
+    # For WebP.
+    lossless: bool = True
+    quality: int = 80
+
+    @property
+    def mimetype(self):
+        return f"image/{self.format}"
+
+
+PNG = Encoding()
+THUMB_PNG = Encoding(palette=256, compress_level=6)
+THUMB_WEBP = Encoding(format="webp", lossless=True)
+
+
+def encode_surface(surface, encoding=PNG):
+    """
+    Encode an ARGB32 image surface as `encoding`, returning a BytesIO.
+    """
+    with timed("encode"):
+        return _encode_surface(surface, encoding)
+
+
+def _encode_surface(surface, encoding):
+    imgio = BytesIO()
+    if encoding.format == "png" and encoding.compress_level is None:
+        surface.write_to_png(imgio)
+    else:
+        # Our backgrounds are opaque, so we can ignore alpha, and read the
+        # surface's memory directly as (little-endian) BGRX pixels.
+        surface.flush()
+        size = (surface.get_width(), surface.get_height())
+        im = Image.frombuffer(
+            "RGB", size, surface.get_data(), "raw", "BGRX", surface.get_stride(), 1
+        )
+        if encoding.format == "png":
+            if encoding.palette:
+                im = im.quantize(encoding.palette, method=Image.Quantize.FASTOCTREE)
+            im.save(imgio, "PNG", compress_level=encoding.compress_level)
+        else:
+            im.save(
+                imgio, "WEBP", lossless=encoding.lossless, quality=encoding.quality
+            )
+    imgio.seek(0)
+    return imgio
+
+
+def draw_png(
+    curve, size, render=None, with_metadata=False, with_more=0, encoding=PNG
+):
     width, height = size
     if render is None:
         render = curve.render
     with cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height) as surface:
         render.draw(surface, size, curve, with_more=with_more)
-        pngio = BytesIO()
-        surface.write_to_png(pngio)
-    pngio.seek(0)
+        pngio = encode_surface(surface, encoding)
 
     if with_metadata:
-        im = Image.open(pngio)
-        info = PngImagePlugin.PngInfo()
-        info.add_text("Software", "https://flourish.nedbat.com")
-        info.add_text(PNG_STATE_KEY, json.dumps(curve.short_parameters()))
-        pngio = BytesIO()
-        im.save(pngio, "PNG", pnginfo=info)
-        pngio.seek(0)
+        with timed("metadata"):
+            pngio = BytesIO(add_text(pngio.getvalue(), png_texts(curve)))
 
     return pngio
+
+
+def png_texts(curve):
+    """
+    The text chunks to put in a PNG of `curve`, so it can be uploaded again.
+    """
+    return {
+        "Software": "https://flourish.nedbat.com",
+        PNG_STATE_KEY: json.dumps(curve.short_parameters()),
+    }
+
+
+def draw_sprite(curves, size, columns, render=None, encoding=PNG):
+    """
+    Draw a number of curves in a grid on one image.
+
+    Each curve gets a cell of `size`, in rows of `columns` cells.  Each curve
+    is drawn with its own render unless `render` is provided.
+    """
+    width, height = size
+    rows = -(-len(curves) // columns)
+    sprite_size = (width * columns, height * rows)
+    with cairo.ImageSurface(cairo.FORMAT_ARGB32, *sprite_size) as surface:
+        for i, curve in enumerate(curves):
+            row, col = divmod(i, columns)
+            origin = (col * width, row * height)
+            (render or curve.render).draw(surface, size, curve, origin=origin)
+        return encode_surface(surface, encoding)
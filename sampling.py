@@ -0,0 +1,49 @@
+"""
+Choosing the times at which to sample a curve.
+"""
+
+import math
+
+import numpy as np
+
+from budget import check_deadline
+
+
+def adaptive_times(func, start, stop, max_step, min_step, tolerance):
+    """
+    Choose times in [start, stop] so that straight lines between the samples
+    stay within `tolerance` of the curve.
+
+    `func(t)` evaluates the curve at an array of times, returning an N×2 array
+    of points.  Samples start no more than `max_step` apart, which must be
+    small enough not to skip over any features of the curve.  An interval
+    is split in half if its midpoint is farther than `tolerance` from the
+    chord between its ends, until intervals are `min_step` long.
+
+    Returns an array of times.
+    """
+    nsteps = max(math.ceil((stop - start) / max_step), 1)
+    t = np.linspace(start, stop, nsteps + 1)
+    pts = func(t)
+    # done[i] is True when the interval from t[i] to t[i+1] needs no splitting.
+    done = np.zeros(nsteps, dtype=bool)
+    while True:
+        check_deadline()
+        todo = np.flatnonzero(~done)
+        if len(todo) == 0:
+            break
+        tmid = (t[todo] + t[todo + 1]) / 2
+        pmid = func(tmid)
+        chord_mid = (pts[todo] + pts[todo + 1]) / 2
+        error = np.hypot(*(pmid - chord_mid).T)
+        split = (error > tolerance) & (t[todo + 1] - t[todo] >= 2 * min_step)
+        done[todo[~split]] = True
+        if not split.any():
+            break
+        # A split interval keeps its place as the left half, and the right half
+        # is inserted after it.  Both halves need to be checked again.
+        where = todo[split] + 1
+        t = np.insert(t, where, tmid[split])
+        pts = np.insert(pts, where, pmid[split], axis=0)
+        done = np.insert(done, where, False)
+    return t
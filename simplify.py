@@ -0,0 +1,88 @@
+"""
+Thinning out sampled points where the output doesn't need all of them.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from budget import check_deadline
+
+
+def simplify_indices(xy, tolerance):
+    """
+    Choose points of a polyline to keep, using Ramer-Douglas-Peucker.
+
+    `xy` is an N×2 array of points.  The polyline through the kept points
+    stays within `tolerance` of every dropped point.  The first and last
+    points are always kept.
+
+    Returns a sorted array of indexes into `xy`.
+    """
+    n = len(xy)
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    # Every pass measures all the points against the chord of the span they
+    # are in, and splits each span that is too far off at its farthest point.
+    while True:
+        check_deadline()
+        kept = np.flatnonzero(keep)
+        span = np.repeat(np.arange(len(kept) - 1), np.diff(kept))
+        first = xy[kept[span]]
+        chord = xy[kept[span + 1]] - first
+        rel = xy[:-1] - first
+        length = np.hypot(*chord.T)
+        cross = np.abs(chord[:, 0] * rel[:, 1] - chord[:, 1] * rel[:, 0])
+        # A closed loop has no chord: measure from the shared end point.
+        dist = np.where(
+            length > 0, cross / np.where(length > 0, length, 1), np.hypot(*rel.T)
+        )
+        span_max = np.maximum.reduceat(dist, kept[:-1])
+        split = span_max > tolerance
+        if not split.any():
+            break
+        farthest = np.flatnonzero(split[span] & (dist == span_max[span]))
+        # Ties split at the first of the farthest points.
+        _, firsts = np.unique(span[farthest], return_index=True)
+        keep[farthest[firsts]] = True
+    return np.flatnonzero(keep)
+
+
+def quantize(pts, quantum):
+    """
+    Round the x and y columns of `pts` to multiples of `quantum`, dropping
+    points that land on the same spot as the point before them.
+    """
+    pts = pts.copy()
+    pts[:, :2] = np.round(pts[:, :2] / quantum) * quantum
+    moved = np.any(pts[1:, :2] != pts[:-1, :2], axis=1)
+    return pts[np.concatenate([[True], moved])]
+
+
+@dataclass(frozen=True)
+class Simplification:
+    """
+    How much detail to drop from points before drawing them, in pixels.
+
+    `tolerance` is how far the simplified line may stray from the samples,
+    and `quantum` is the grid coordinates are rounded to.  Either can be
+    None to skip that step.
+    """
+
+    tolerance: float = None
+    quantum: float = None
+
+    def __call__(self, pts):
+        """
+        Simplify an array of points with x and y in the first two columns.
+        Any other columns go along with their points.
+        """
+        if len(pts) == 0:
+            return pts
+        if self.tolerance:
+            pts = pts[simplify_indices(pts[:, :2], self.tolerance)]
+        if self.quantum:
+            pts = quantize(pts, self.quantum)
+        return pts
@@ -1,3 +1,5 @@
+import functools
+import itertools
 import math
 from dataclasses import dataclass, field
 from fractions import Fraction
@@ -6,6 +8,7 @@ import numpy as np
 
 from curve import Curve, ImpossibleCurve
 from parameter import Parameter, Parameterized
+from sampling import adaptive_times
 from util import abc
 
 
@@ -121,18 +124,48 @@ class Spirograph(Curve):
         return curve
 
     @classmethod
-    def make_random(cls, rnd):
+    def make_random(cls, rnd, max_complexity=None):
+        """
+        Make a random Spirograph.
+
+        If `max_complexity` is provided, choose only among valid curves with
+        less complexity than that.
+        """
+        if max_complexity is None:
+            gears = (
+                rnd.randint(10, 40),
+                rnd.choice([0, 1]),
+                rnd.randint(5, 10),
+                rnd.choice([0, 1]),
+            )
+            pen_extra = rnd.randint(0, 5) * 0.5
+            speeds = (rnd.randint(-2, 2), rnd.choice([1, 2]))
+        else:
+            *gears, last_speed, last_speed_denom = rnd.choice(
+                random_choices(max_complexity)
+            )
+            pen_extra = rnd.randint(0, 5) * 0.5
+            speeds = (last_speed, last_speed_denom)
+        return cls._from_choices(*gears, pen_extra, *speeds)
+
+    @classmethod
+    def _from_choices(
+        cls,
+        teeth_a,
+        inside_a,
+        teeth_b,
+        inside_b,
+        pen_extra,
+        last_speed,
+        last_speed_denom,
+    ):
         curve = cls()
         curve.outer_teeth = 144
-        curve.gears.append(
-            Gear(name="ga", teeth=rnd.randint(10, 40), inside=rnd.choice([0, 1]))
-        )
-        curve.gears.append(
-            Gear(name="gb", teeth=rnd.randint(5, 10), inside=rnd.choice([0, 1]))
-        )
-        curve.pen_extra = rnd.randint(0, 5) * 0.5
-        curve.last_speed = rnd.randint(-2, 2)
-        curve.last_speed_denom = rnd.choice([1, 2])
+        curve.gears.append(Gear(name="ga", teeth=teeth_a, inside=inside_a))
+        curve.gears.append(Gear(name="gb", teeth=teeth_b, inside=inside_b))
+        curve.pen_extra = pen_extra
+        curve.last_speed = last_speed
+        curve.last_speed_denom = last_speed_denom
         return curve
 
     def complexity(self):
@@ -182,6 +215,40 @@ class Spirograph(Curve):
         cycles = math.lcm(*[c.speed.denominator for c in self._make_circles()])
         return cycles
 
+    def _symmetry(self):
+        """
+        Find the rotational symmetry of the full curve.
+
+        Returns (nlobes, period, angle): the curve is `nlobes` copies of its
+        first `period` of time, each rotated by `angle` from the one before.
+        """
+        circles = self._make_circles()
+        base = circles[0].speed
+        # Shifting time by 2π·k turns each circle by 2π·speed·k.  If all those
+        # turns agree (mod 2π), the whole curve is rotated.  That needs
+        # (speed - base)·k to be an integer for every circle.  For a difference
+        # of p/q, k must be a multiple of q/p, so the smallest k is the least
+        # common multiple of those.
+        k = None
+        for circle in circles:
+            diff = circle.speed - base
+            if diff == 0:
+                continue
+            step = Fraction(diff.denominator, abs(diff.numerator))
+            if k is None:
+                k = step
+            else:
+                k = Fraction(
+                    math.lcm(k.numerator, step.numerator),
+                    math.gcd(k.denominator, step.denominator),
+                )
+        cycles = self._cycles()
+        if k is None or k >= cycles:
+            return 1, 2 * math.pi * cycles, 0.0
+        nlobes = int(cycles / k)
+        angle = 2 * math.pi * float((base * k) % 1)
+        return nlobes, 2 * math.pi * float(k), angle
+
     def _scale(self):
         scale = 0
         for circle in self._make_circles():
@@ -189,20 +256,65 @@ class Spirograph(Curve):
         scale *= 1.05
         return scale
 
-    def points(self, dims, scale, dt=0.01):
-        circles = self._make_circles()
+    def cache_key(self):
+        if self.max_cycles is not None:
+            # Animation frames are each drawn once, no point caching them.
+            return None
+        return super().cache_key()
+
+    def compute_samples(self, dims, dt, tolerance=None):
+        if self.max_cycles is not None:
+            return super().compute_samples(dims, dt, tolerance)
+        nlobes, period, angle = self._symmetry()
+        if nlobes == 1:
+            return super().compute_samples(dims, dt, tolerance)
+
+        # Compute one lobe, and make the rest by rotating it.
+        if tolerance is None:
+            t = dt * np.arange(math.ceil(period / dt))
+        else:
+            t = adaptive_times(
+                lambda t: self.evaluate(["x", "y"], t),
+                0,
+                period,
+                max_step=self.max_time_step(),
+                min_step=dt,
+                tolerance=tolerance,
+            )[:-1]
+        lobe = self.evaluate(dims, t)
+        # As complex numbers, a point is y + x·i, so rotating the curve by
+        # `angle` is multiplying by e^(angle·i).
+        zs = lobe[:, 1] + 1j * lobe[:, 0]
+        turns = np.exp(1j * angle * np.arange(nlobes))
+        zs = np.outer(turns, zs).ravel()
+        pts = np.empty((len(zs) + 1, 2), dtype=self.dtype)
+        pts[:-1, 0] = zs.imag
+        pts[:-1, 1] = zs.real
+        # The curve ends where it started.
+        pts[-1] = pts[0]
+        return pts
+
+    def time_grid(self, dt):
         cycles = self.max_cycles or self._cycles()
         stop = math.pi * 2 * cycles
-        t = np.arange(start=0, stop=stop + dt / 2, step=dt)
+        return 0, dt, math.ceil((stop + dt / 2) / dt)
+
+    def max_time_step(self):
+        fastest = max(abs(float(circle.speed)) for circle in self._make_circles())
+        # An eighth of a turn of the fastest circle.
+        return (math.pi / 4) / fastest
+
+    def evaluate(self, dims, t):
+        circles = self._make_circles()
         x = y = 0
         for circle in circles:
             cx, cy = circle(t)
             x += cx
             y += cy
-        scale /= self._scale()
+        scale = 1 / self._scale()
         x *= scale
         y *= scale
-        yield from zip(x, y)
+        return np.column_stack((x, y)).astype(self.dtype, copy=False)
 
     def draw_more(self, ctx, scale, param):
         scale /= self._scale()
@@ -235,6 +347,30 @@ class Spirograph(Curve):
         ctx.fill()
 
 
+@functools.lru_cache(maxsize=None)
+def random_choices(max_complexity):
+    """
+    All the random choices for `Spirograph.make_random` that make valid curves
+    with less than `max_complexity`.
+
+    Returns a list of (teeth_a, inside_a, teeth_b, inside_b, last_speed,
+    last_speed_denom) tuples.  The pen position doesn't affect validity or
+    complexity, so it isn't included.
+    """
+    choices = []
+    for choice in itertools.product(
+        range(10, 41), [0, 1], range(5, 11), [0, 1], range(-2, 3), [1, 2]
+    ):
+        *gears, last_speed, last_speed_denom = choice
+        curve = Spirograph._from_choices(*gears, 0.0, last_speed, last_speed_denom)
+        try:
+            if curve.complexity() < max_complexity:
+                choices.append(choice)
+        except ImpossibleCurve:
+            pass
+    return choices
+
+
 def draw_gear(ctx, scale, cx, cy, radius, nteeth, dθ):
     radius *= scale
     ctx.arc(cx, cy, radius, 0, 2 * math.pi)
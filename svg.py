@@ -0,0 +1,88 @@
+"""
+Writing SVG directly from arrays of points, without going through cairo.
+"""
+
+import math
+
+import numpy as np
+
+from budget import check_deadline
+
+# Path data is formatted this many points at a time.
+SVG_CHUNK = 20_000
+
+
+def svg_start(size):
+    """
+    The start of an SVG document of `size` pixels.
+    """
+    width, height = size
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<svg xmlns="http://www.w3.org/2000/svg"'
+        f' width="{width}px" height="{height}px"'
+        f' viewBox="0 0 {width} {height}" version="1.1">\n'
+    )
+
+
+def svg_end():
+    return "</svg>\n"
+
+
+def svg_rect(size, gray):
+    """
+    A rectangle filling an image of `size`.
+    """
+    width, height = size
+    return (
+        f'<rect x="0" y="0" width="{width}" height="{height}"'
+        f' style="fill:{svg_gray(gray)};stroke:none;"/>\n'
+    )
+
+
+def svg_gray(gray):
+    pct = format_numbers(gray * 100, 4)
+    return f"rgb({pct}%,{pct}%,{pct}%)"
+
+
+def iter_svg_path(pts, style, relative=False, decimals=2):
+    """
+    Produce a <path> element through an N×2 array of image coordinates.
+
+    The path data is made a chunk at a time, and yielded as strings.  With
+    `relative`, each point after the first is written as the change from the
+    point before it, which is usually shorter.  Coordinates are rounded to
+    `decimals` places.
+    """
+    yield f'<path style="{style}" d="'
+    if len(pts):
+        # Rounding to integer units first means relative moves add up to
+        # exactly the rounded absolute points.
+        units = np.round(pts * 10 ** decimals).astype(np.int64)
+        yield "M" + format_numbers(units[0] / 10 ** decimals, decimals)
+        if relative:
+            units = np.diff(units, axis=0)
+            cmd = "l"
+        else:
+            units = units[1:]
+            cmd = "L"
+        if len(units):
+            yield cmd
+        for i in range(0, len(units), SVG_CHUNK):
+            check_deadline()
+            chunk = units[i:i + SVG_CHUNK] / 10 ** decimals
+            yield (" " if i else "") + format_numbers(chunk, decimals)
+    yield '"/>\n'
+
+
+def format_numbers(values, decimals):
+    """
+    Format an array of numbers into a space-separated string, with at most
+    `decimals` places after the decimal point and no trailing zeros.
+    """
+    values = np.round(np.ravel(values), decimals) + 0.0    # No "-0".
+    biggest = np.max(np.abs(values)) if len(values) else 0
+    digits = (math.floor(math.log10(biggest)) + 1 if biggest >= 1 else 1) + decimals
+    # One %-format of many numbers at once keeps the work out of Python.
+    fmt = " ".join([f"%.{digits}g"] * len(values))
+    return fmt % tuple(values.tolist())
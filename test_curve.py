@@ -0,0 +1,33 @@
+import random
+
+from curve import sample_cache
+from harmonograph import Harmonograph
+from render import lookup
+
+
+def sample_at(curve, size):
+    render = curve.render
+    return curve.samples(
+        ["x", "y"],
+        scale=min(size) / 2,
+        dt=lookup(size[0], render.DTS),
+        max_error=render.max_error,
+    )
+
+
+def test_nearby_sizes_share_samples():
+    curve = Harmonograph.make_random(random.Random(17), 3, "N")
+    sample_cache.clear()
+    before = sample_cache.stats()
+    big = sample_at(curve, (1920, 1080))
+    small = sample_at(curve, (1600, 900))
+    after = sample_cache.stats()
+    assert after["misses"] - before["misses"] == 1
+    assert after["hits"] - before["hits"] == 1
+    assert len(big) == len(small)
+
+
+def test_harmonograph_without_waves():
+    curve = Harmonograph.from_params({})
+    pts = sample_at(curve, (1920, 1080))
+    assert pts.shape[1] == 2
@@ -0,0 +1,98 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image, PngImagePlugin
+
+from pngio import PngWriter, add_text, find_text, read_text, text_chunk
+
+TEXTS = {"Software": "https://flourish.nedbat.com", "Flourish State": '{"a": 1}'}
+
+
+def pillow_png(pixels, info=None):
+    pngio = BytesIO()
+    Image.fromarray(pixels).save(pngio, "PNG", pnginfo=info)
+    return pngio.getvalue()
+
+
+def random_pixels(height, width):
+    return np.random.default_rng(17).integers(0, 256, (height, width, 3), np.uint8)
+
+
+def test_add_text_is_read_by_pillow():
+    pixels = random_pixels(20, 30)
+    texts = dict(TEXTS, Caption="Spirals \N{SNOWMAN}")
+    png = add_text(pillow_png(pixels), texts)
+    im = Image.open(BytesIO(png))
+    for key, value in texts.items():
+        assert im.info[key] == value
+    assert np.array_equal(np.asarray(im), pixels)
+
+
+def test_add_text_is_found():
+    png = add_text(pillow_png(random_pixels(5, 5)), dict(TEXTS, Caption="\N{SNOWMAN}"))
+    assert find_text(BytesIO(png), "Flourish State") == '{"a": 1}'
+    assert find_text(BytesIO(png), "Caption") == "\N{SNOWMAN}"
+    assert find_text(BytesIO(png), "Nothing") is None
+    assert read_text(BytesIO(png)) == dict(TEXTS, Caption="\N{SNOWMAN}")
+
+
+def test_add_text_needs_a_png():
+    with pytest.raises(ValueError):
+        add_text(b"GIF89a", TEXTS)
+
+
+@pytest.mark.parametrize("zip", [False, True])
+def test_find_text_in_pillow_downloads(zip):
+    # Downloads used to be written by Pillow, and should still upload.
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Software", "https://flourish.nedbat.com", zip=zip)
+    info.add_text("Flourish State", '{"a": 1}', zip=zip)
+    info.add_itxt("Caption", "\N{SNOWMAN}", zip=zip)
+    png = pillow_png(random_pixels(5, 5), info)
+    assert find_text(BytesIO(png), "Flourish State") == '{"a": 1}'
+    assert find_text(BytesIO(png), "Caption") == "\N{SNOWMAN}"
+
+
+def test_find_text_stops_at_image_data():
+    png = pillow_png(random_pixels(50, 50))
+    # Text after the image data isn't looked for.
+    iend = png.rindex(b"IEND") - 4
+    late = png[:iend] + text_chunk("Software", "late") + png[iend:]
+    assert read_text(BytesIO(late)) == {"Software": "late"}
+    assert find_text(BytesIO(late), "Software") is None
+    # So the image data isn't read, and doesn't count against max_bytes.
+    assert find_text(BytesIO(png), "Software", max_bytes=100) is None
+
+
+def test_find_text_max_bytes():
+    png = add_text(pillow_png(random_pixels(5, 5)), {"Big": "x" * 10_000, **TEXTS})
+    assert find_text(BytesIO(png), "Flourish State", max_bytes=20_000) == '{"a": 1}'
+    with pytest.raises(ValueError):
+        find_text(BytesIO(png), "Flourish State", max_bytes=1000)
+
+
+def test_bad_crc():
+    png = bytearray(add_text(pillow_png(random_pixels(5, 5)), TEXTS))
+    # A byte of the first text chunk's data.
+    png[45] ^= 0xFF
+    with pytest.raises(ValueError):
+        read_text(BytesIO(bytes(png)))
+
+
+def test_png_writer_round_trip():
+    pixels = random_pixels(100, 70)
+    pngio = BytesIO()
+    writer = PngWriter(pngio, (70, 100), texts=TEXTS)
+    # Small IDAT chunks, so the image data is split across many of them.
+    writer.IDAT_SIZE = 1000
+    for y in range(0, 100, 32):
+        writer.write_rows(pixels[y:y + 32])
+    writer.close()
+    png = pngio.getvalue()
+    assert png.count(b"IDAT") > 1
+    im = Image.open(BytesIO(png))
+    assert im.size == (70, 100)
+    assert np.array_equal(np.asarray(im.convert("RGB")), pixels)
+    assert find_text(BytesIO(png), "Flourish State") == '{"a": 1}'
+    assert read_text(BytesIO(png)) == TEXTS
@@ -0,0 +1,160 @@
+"""
+Measuring where the time goes in a request.
+
+Code marks its phases with `timed(name)`.  While a request is being timed,
+the time in each phase is added up, not counting time in phases nested
+inside it.  Outside of a timed request, `timed` does almost nothing.
+"""
+
+import bisect
+import contextlib
+import cProfile
+import heapq
+import os
+import threading
+import time
+
+from parameter import GlobalParameter
+
+# The Timings for the current request, or None.
+current_timings = GlobalParameter("timings", default=None)
+
+
+class Timings:
+    """
+    Seconds spent in each phase of one request.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        # The phases we're in: [name, when we started counting time for it].
+        self.stack = []
+
+    def _charge(self, now):
+        name, start = self.stack[-1]
+        self.seconds[name] = self.seconds.get(name, 0.0) + now - start
+
+    def enter(self, name):
+        now = time.perf_counter()
+        if self.stack:
+            self._charge(now)
+        self.stack.append([name, now])
+
+    def exit(self):
+        now = time.perf_counter()
+        self._charge(now)
+        self.stack.pop()
+        if self.stack:
+            self.stack[-1][1] = now
+
+
+@contextlib.contextmanager
+def timed(name):
+    """
+    Count the time in this context as the phase `name`.
+    """
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    timings.enter(name)
+    try:
+        yield
+    finally:
+        timings.exit()
+
+
+def server_timing(seconds):
+    """
+    Format a dict of phase durations as a Server-Timing header value.
+    """
+    return ", ".join(
+        f"{name};dur={secs * 1000:.1f}" for name, secs in seconds.items()
+    )
+
+
+class Histogram:
+    """
+    A Prometheus-style histogram of durations, with labels.
+    """
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = sorted(buckets)
+        self.lock = threading.Lock()
+        # Label tuples map to [bucket counts..., sum, count].
+        self.series = {}
+
+    def observe(self, labels, value):
+        labels = tuple(sorted(labels.items()))
+        ibucket = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            data = self.series.get(labels)
+            if data is None:
+                data = self.series[labels] = [0] * (len(self.buckets) + 2)
+            # Buckets are cumulative, so count this in every bucket it fits.
+            for i in range(ibucket, len(self.buckets)):
+                data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def exposition(self):
+        """
+        The lines of Prometheus text format for this histogram.
+        """
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            series = {labels: list(data) for labels, data in self.series.items()}
+        for labels, data in sorted(series.items()):
+            label_text = "".join(f'{k}="{v}",' for k, v in labels)
+            les = [*self.buckets, "+Inf"]
+            for le, count in zip(les, [*data[:-2], data[-1]]):
+                lines.append(f'{self.name}_bucket{{{label_text}le="{le}"}} {count}')
+            label_text = label_text.rstrip(",")
+            lines.append(f"{self.name}_sum{{{label_text}}} {data[-2]}")
+            lines.append(f"{self.name}_count{{{label_text}}} {data[-1]}")
+        return lines
+
+
+class SlowestProfiles:
+    """
+    Keep cProfile output for the slowest requests seen, in a directory.
+    """
+
+    def __init__(self, directory, keep):
+        self.directory = directory
+        self.keep = keep
+        self.lock = threading.Lock()
+        # A min-heap of (seconds, path), so the fastest kept one is first.
+        self.kept = []
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already running in this thread.
+            return None
+        return profiler
+
+    def finish(self, profiler, seconds, name):
+        """
+        Stop `profiler`, and keep its output if the request was slow enough.
+        """
+        profiler.disable()
+        with self.lock:
+            if len(self.kept) >= self.keep and seconds <= self.kept[0][0]:
+                return
+            filename = f"{seconds * 1000:08.0f}ms-{name}-{time.time():.0f}.prof"
+            path = os.path.join(self.directory, filename)
+            profiler.dump_stats(path)
+            heapq.heappush(self.kept, (seconds, path))
+            while len(self.kept) > self.keep:
+                _, old_path = heapq.heappop(self.kept)
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(old_path)
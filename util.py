@@ -13,13 +13,16 @@ def dict_to_slug(d):
     return "".join(itertools.chain.from_iterable((k, str(v)) for k, v in d.items()))
 
 
+SLUG_ITEM = re.compile(r"([a-z]+)(-?\d+)")
+
+
 def slug_to_dict(s):
     """
     A slug becomes a dict.
 
     abc123def456x-76y99 becomes {"abc": "123", "def": "456", "x": "-76", "y": "99"}
     """
-    return dict(re.findall(r"([a-z]+)(-?\d+)", s))
+    return dict(SLUG_ITEM.findall(s))
 
 
 def abc(i):
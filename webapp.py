@@ -1,8 +1,12 @@
+import dataclasses
 import hashlib
+import hmac
 import json
 import os
 import random
+import tempfile
 import textwrap
+import time
 from dataclasses import dataclass
 from io import BytesIO
 
@@ -10,6 +14,8 @@ from dataclasses_json import dataclass_json
 from dotenv import load_dotenv
 from flask import (
     Flask,
+    abort,
+    g,
     request,
     render_template,
     render_template_string,
@@ -18,39 +24,135 @@ from flask import (
     send_file,
 )
 from flask_wtf import FlaskForm
-from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
 from wtforms import BooleanField, IntegerField
 from wtforms.widgets import NumberInput
 from wtforms.validators import DataRequired
 
-from constants import FULLX, FULLY, MANY_SETTINGS_COOKIE, PNG_STATE_KEY, THUMBX, THUMBY
-from curve import Curve, ImpossibleCurve
+from budget import Budget, OverBudget
+from cache import DiskCache
+from constants import (
+    CACHE_DIR_ENV,
+    CACHE_MB_ENV,
+    FULLX,
+    FULLY,
+    MANY_SETTINGS_COOKIE,
+    MAX_UPLOAD_BYTES,
+    MAX_UPLOAD_SCAN_BYTES,
+    METRICS_TOKEN_ENV,
+    PNG_STATE_KEY,
+    PROFILE_DIR_ENV,
+    PROFILE_KEEP_ENV,
+    PROFILE_RATE_ENV,
+    SPIRO_MAX_COMPLEXITY,
+    THUMBX,
+    THUMBY,
+)
+from curve import Curve, sample_cache
 from harmonograph import Harmonograph
-from render import draw_png, draw_svg
-from spirograph import Spirograph
+from pngio import find_text
+from render import (
+    PNG,
+    THUMB_PNG,
+    THUMB_WEBP,
+    Placeholder,
+    draw_png,
+    draw_sprite,
+    draw_svg,
+    drawing_version,
+    estimated_samples,
+)
+from simplify import Simplification
+from spirograph import Spirograph, random_choices
+from timing import (
+    Histogram,
+    SlowestProfiles,
+    Timings,
+    current_timings,
+    server_timing,
+    timed,
+)
 from util import dict_to_slug, slug_to_dict
 
 load_dotenv()
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY")
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
+
+png_cache = DiskCache(
+    os.environ.get(CACHE_DIR_ENV) or os.path.join(tempfile.gettempdir(), "flourish"),
+    max_bytes=int(os.environ.get(CACHE_MB_ENV, "200")) * 1_000_000,
+    suffix=".png",
+)
+
+# How much work each route will do before drawing a placeholder instead.
+ONE_BUDGET = Budget(max_pixels=FULLX * FULLY, max_samples=1_000_000, seconds=10)
+PNG_BUDGET = Budget(max_pixels=FULLX * FULLY, max_samples=2_000_000, seconds=10)
+DOWNLOAD_BUDGET = Budget(
+    max_pixels=4 * FULLX * FULLY, max_samples=4_000_000, seconds=30
+)
+SPRITE_BUDGET = Budget(
+    max_pixels=2 * FULLX * FULLY, max_samples=4_000_000, seconds=20
+)
+PLACEHOLDER = Placeholder()
+
+# The inline SVG on /one only needs to look right at its own size, so drop
+# points that don't change the picture.
+ONE_SIMPLIFY = Simplification(tolerance=0.25, quantum=0.1)
+
+# Where the time goes in requests, for /metrics.
+TIME_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+PHASE_SECONDS = Histogram(
+    "flourish_phase_seconds", "Time spent in each phase of requests.", TIME_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "flourish_request_seconds", "Total time spent handling requests.", TIME_BUCKETS
+)
+
+if os.environ.get(PROFILE_DIR_ENV):
+    profiles = SlowestProfiles(
+        os.environ[PROFILE_DIR_ENV],
+        keep=int(os.environ.get(PROFILE_KEEP_ENV, "10")),
+    )
+    profile_rate = float(os.environ.get(PROFILE_RATE_ENV, "0.1"))
+else:
+    profiles = None
+
+# Build the table of random spirograph choices now, not on the first request.
+random_choices(SPIRO_MAX_COMPLEXITY)
 
 
 @dataclass
 class Thumb:
     curve: Curve
     size: object
+    # If drawn from a sprite sheet: (url, column, row, columns, rows).
+    sprite: object = None
 
     def as_html(self, title=None):
         url = one_url("/one", self.curve)
         sx = self.size[0]
         sy = self.size[1]
-        pngurl = one_url("/png", self.curve, sx=sx * 2, sy=sy * 2)
+        if self.sprite:
+            pngurl, col, row, ncols, nrows = self.sprite
+        else:
+            pngurl = one_url("/png", self.curve, sx=sx * 2, sy=sy * 2)
+            col = row = ncols = nrows = None
         return render_template_string(
             """
             <span>
                 <a href="{{url}}" {% if title %}title="{{ title }}"{% endif %}>
                     <div class="thumb">
+                        {% if ncols %}
+                        <div role="img" style="
+                            width: {{sx}}px; height: {{sy}}px;
+                            background-image: url({{pngurl}});
+                            background-size: {{sx * ncols}}px {{sy * nrows}}px;
+                            background-position: -{{sx * col}}px -{{sy * row}}px;
+                        "></div>
+                        {% else %}
                         <img src={{pngurl}} width="{{sx}}" height="{{sy}}" />
+                        {% endif %}
                     </div>
                 </a>
             </span>
@@ -59,10 +161,45 @@ class Thumb:
             pngurl=pngurl,
             sx=sx,
             sy=sy,
+            col=col,
+            row=row,
+            ncols=ncols,
+            nrows=nrows,
             title=title,
         )
 
 
+# Sprite sheet URLs list all their curves, so they can get long.  Keep them
+# shorter than this, which proxies and browsers are happy with.
+MAX_SPRITE_URL = 4000
+SPRITE_COLUMNS = 6
+
+
+def use_sprites(thumbs):
+    """
+    Set the thumbs to draw from sprite sheets, rather than an image each.
+
+    All the thumbs must be the same size.  As many as fit in a URL share
+    a sheet.
+    """
+    if not thumbs:
+        return
+    sx, sy = thumbs[0].size
+    layout = dict_to_slug({"sx": sx * 2, "sy": sy * 2, "n": SPRITE_COLUMNS})
+    sheets = []
+    for thumb in thumbs:
+        slug = dict_to_slug(thumb.curve.short_parameters())
+        if not sheets or len(sheets[-1][0]) + len(slug) + 1 > MAX_SPRITE_URL:
+            sheets.append([f"/sprite/{layout}", []])
+        sheets[-1][0] += "/" + slug
+        sheets[-1][1].append(thumb)
+    for url, sheet in sheets:
+        nrows = -(-len(sheet) // SPRITE_COLUMNS)
+        for i, thumb in enumerate(sheet):
+            row, col = divmod(i, SPRITE_COLUMNS)
+            thumb.sprite = (url, col, row, SPRITE_COLUMNS, nrows)
+
+
 @dataclass_json
 @dataclass
 class ManySettings:
@@ -85,8 +222,67 @@ class ManySettingsForm(FlaskForm):
     no_symmetry = BooleanField("None")
 
 
+@app.before_request
+def start_timing():
+    g.start_time = time.perf_counter()
+    g.timings = Timings()
+    g.timings_token = current_timings.set(g.timings)
+    g.profiler = None
+    if profiles is not None and random.random() < profile_rate:
+        g.profiler = profiles.start()
+
+
+@app.after_request
+def finish_timing(resp):
+    total = time.perf_counter() - g.start_time
+    endpoint = request.endpoint or "none"
+    phases = g.timings.seconds
+    resp.headers["Server-Timing"] = server_timing({**phases, "total": total})
+    for phase, seconds in phases.items():
+        PHASE_SECONDS.observe({"endpoint": endpoint, "phase": phase}, seconds)
+    REQUEST_SECONDS.observe({"endpoint": endpoint}, total)
+    if g.profiler is not None:
+        profiles.finish(g.profiler, total, endpoint)
+        g.profiler = None
+    return resp
+
+
+@app.teardown_request
+def stop_timing(exc):
+    token = g.pop("timings_token", None)
+    if token is not None:
+        current_timings.reset(token)
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+
+
+# Gallery pages are made from a random seed in their URL, so that the same
+# page always shows the same curves, and their thumbnails can be cached.
+SEED_LIMIT = 1_000_000_000
+
+
+def seeded_random():
+    """
+    Get a Random seeded from this request's "seed" argument, or None if it
+    doesn't have a usable one.
+    """
+    try:
+        seed = int(request.args["seed"])
+    except (KeyError, ValueError):
+        return None
+    return random.Random(seed)
+
+
+def redirect_to_new_seed():
+    return redirect(f"{request.path}?seed={random.randrange(SEED_LIMIT)}")
+
+
 @app.route("/", methods=["GET", "POST"])
 def many():
+    rnd = seeded_random()
+    if rnd is None:
+        return redirect_to_new_seed()
     cookie_settings = request.cookies.get(MANY_SETTINGS_COOKIE)
     if cookie_settings is not None:
         settings = ManySettings.from_json(cookie_settings)
@@ -106,28 +302,32 @@ def many():
     if syms:
         thumbs = [
             Thumb(
-                Harmonograph.make_random(random, npend=settings.npend, syms=syms),
+                Harmonograph.make_random(rnd, npend=settings.npend, syms=syms),
                 size=size,
             )
             for _ in range(30)
         ]
     else:
         thumbs = []
+    use_sprites(thumbs)
     form = ManySettingsForm(obj=settings)
     return render_template("many.html", thumbs=thumbs, form=form)
 
 
 @app.route("/spiro", methods=["GET", "POST"])
 def spirographs():
+    rnd = seeded_random()
+    if rnd is None:
+        return redirect_to_new_seed()
     size = (THUMBX, THUMBY)
-    thumbs = []
-    while len(thumbs) < 30:
-        try:
-            curve = Spirograph.make_random(random)
-            if curve.complexity() < 5000:
-                thumbs.append(Thumb(curve, size=size))
-        except ImpossibleCurve:
-            pass
+    thumbs = [
+        Thumb(
+            Spirograph.make_random(rnd, max_complexity=SPIRO_MAX_COMPLEXITY),
+            size=size,
+        )
+        for _ in range(30)
+    ]
+    use_sprites(thumbs)
     return render_template("many.html", thumbs=thumbs)
 
 
@@ -145,7 +345,17 @@ def manysettings():
 def one(slug):
     params = slug_to_dict(slug)
     curve = Curve.any_from_params(params)
-    svg = draw_svg(curve=curve, size=(FULLX // 2, FULLY // 2))
+    size = (FULLX // 2, FULLY // 2)
+    try:
+        ONE_BUDGET.check_samples(estimated_samples(curve, size))
+        with ONE_BUDGET.time_limit():
+            # The SVG is built completely before responding, so that running
+            # out of budget partway can still show the placeholder.
+            svg = draw_svg(
+                curve=curve, size=size, simplify=ONE_SIMPLIFY, relative=True
+            )
+    except OverBudget:
+        svg = draw_svg(curve=curve, size=size, render=PLACEHOLDER)
     params = list(curve.parameters())
     shorts = curve.short_parameters()
     param_display = []
@@ -183,35 +393,192 @@ def one(slug):
 @app.route("/png/<slug>")
 def png(slug):
     params = slug_to_dict(slug)
+    encoding = thumb_encoding()
+    etag = image_etag("png", params, encoding, PNG_BUDGET)
+    if etag in request.if_none_match:
+        return not_modified(etag, negotiated=True)
     curve = Curve.any_from_params(params)
     sx, sy = int(params.get("sx", FULLX)), int(params.get("sy", FULLY))
-    png_bytes = draw_png(curve=curve, size=(sx, sy))
-    return send_file(png_bytes, mimetype="image/png")
+    size = PNG_BUDGET.fit((sx, sy))
+    try:
+        PNG_BUDGET.check_samples(estimated_samples(curve, size))
+        with PNG_BUDGET.time_limit():
+            img_bytes = cached_png(curve=curve, size=size, encoding=encoding)
+    except OverBudget:
+        return degraded(draw_png(curve=curve, size=size, render=PLACEHOLDER))
+    resp = send_file(img_bytes, mimetype=encoding.mimetype)
+    return immutable(resp, etag, negotiated=True)
 
 
 @app.route("/download/<slug>")
 def download(slug):
     params = slug_to_dict(slug)
+    etag = image_etag("download", params, DOWNLOAD_BUDGET)
+    if etag in request.if_none_match:
+        return not_modified(etag)
     curve = Curve.any_from_params(params)
     sx, sy = int(params.get("sx", FULLX)), int(params.get("sy", FULLY))
-    png_bytes = draw_png(curve=curve, size=(sx, sy), with_metadata=True)
+    size = DOWNLOAD_BUDGET.fit((sx, sy))
     hash = hashlib.md5(slug.encode("ascii")).hexdigest()[:10]
     filename = f"flourish_{hash}.png"
-    return send_file(
-        png_bytes, as_attachment=True, download_name=filename, mimetype="image/png"
+    try:
+        DOWNLOAD_BUDGET.check_samples(estimated_samples(curve, size))
+        with DOWNLOAD_BUDGET.time_limit():
+            png_bytes = cached_png(curve=curve, size=size, with_metadata=True)
+    except OverBudget:
+        return degraded(draw_png(curve=curve, size=size, render=PLACEHOLDER))
+    return immutable(
+        send_file(
+            png_bytes, as_attachment=True, download_name=filename, mimetype="image/png"
+        ),
+        etag,
+    )
+
+
+@app.route("/sprite/<layout>/<path:slugs>")
+def sprite(layout, slugs):
+    layout = slug_to_dict(layout)
+    slugs = slugs.split("/")
+    encoding = thumb_encoding()
+    etag = image_etag(
+        "sprite",
+        layout,
+        [slug_to_dict(slug) for slug in slugs],
+        encoding,
+        SPRITE_BUDGET,
+    )
+    if etag in request.if_none_match:
+        return not_modified(etag, negotiated=True)
+    columns = max(int(layout["n"]), 1)
+    rows = -(-len(slugs) // columns)
+    sheet_x, sheet_y = SPRITE_BUDGET.fit(
+        (int(layout["sx"]) * columns, int(layout["sy"]) * rows)
+    )
+    size = (max(sheet_x // columns, 1), max(sheet_y // rows, 1))
+    curves = [Curve.any_from_params(slug_to_dict(slug)) for slug in slugs]
+    try:
+        SPRITE_BUDGET.check_samples(
+            sum(estimated_samples(curve, size) for curve in curves)
+        )
+        with SPRITE_BUDGET.time_limit():
+            shorts = [curve.short_parameters() for curve in curves]
+            img_bytes = cached_image(
+                ["sprite", shorts, size, columns, encoding],
+                lambda: draw_sprite(curves, size, columns, encoding=encoding),
+            )
+    except OverBudget:
+        return degraded(draw_sprite(curves, size, columns, render=PLACEHOLDER))
+    resp = send_file(img_bytes, mimetype=encoding.mimetype)
+    return immutable(resp, etag, negotiated=True)
+
+
+def thumb_encoding():
+    """
+    Choose how to encode a thumbnail, based on what the browser accepts.
+    """
+    # Only use WebP if the browser asks for it by name, not just */*.
+    if "image/webp" in request.accept_mimetypes.values():
+        return THUMB_WEBP
+    return THUMB_PNG
+
+
+def cached_png(curve, size, with_metadata=False, encoding=PNG):
+    """
+    Like `draw_png`, but using the on-disk cache of rendered images.
+    """
+    return cached_image(
+        [curve.short_parameters(), size, with_metadata, encoding],
+        lambda: draw_png(
+            curve=curve, size=size, with_metadata=with_metadata, encoding=encoding
+        ),
+    )
+
+
+def cached_image(key_parts, draw):
+    """
+    Get image bytes from the on-disk cache, or `draw()` them if needed.
+
+    `key_parts` is a list that determines the image exactly.  It can contain
+    anything `image_key` can handle.
+    """
+    key = image_key(key_parts)
+    with timed("cache"):
+        img_bytes = png_cache.get(key)
+    if img_bytes is None:
+        img_bytes = draw().getvalue()
+        with timed("cache"):
+            png_cache.put(key, img_bytes)
+    return BytesIO(img_bytes)
+
+
+def image_key(parts):
+    """
+    Make a string key for an image from a list of JSON-able data and
+    dataclasses like Encoding and Budget.  The key includes the drawing
+    version, so images drawn by different code get different keys.
+    """
+    return json.dumps(
+        [drawing_version(), *parts],
+        sort_keys=True,
+        default=dataclasses.astuple,
     )
 
 
+def image_etag(*parts):
+    """
+    Make a strong ETag for an image completely determined by `parts`.
+
+    The parts come from the URL and the route's settings, so this can be done
+    before any drawing.
+    """
+    return hashlib.sha256(image_key(parts).encode("ascii")).hexdigest()[:32]
+
+
+def immutable(resp, etag, negotiated=False):
+    """
+    Mark a response as never changing, so it can be cached forever.
+
+    If `negotiated`, the response depends on the Accept header.
+    """
+    resp.set_etag(etag)
+    # send_file says no-cache when it doesn't know better.
+    resp.cache_control.no_cache = None
+    resp.cache_control.public = True
+    resp.cache_control.max_age = 365 * 24 * 60 * 60
+    resp.cache_control.immutable = True
+    if negotiated:
+        resp.vary.add("Accept")
+    return resp
+
+
+def not_modified(etag, negotiated=False):
+    """
+    A 304 response for a request whose If-None-Match has our ETag.
+    """
+    return immutable(make_response("", 304), etag, negotiated)
+
+
+def degraded(png_bytes):
+    """
+    Respond with a stand-in image, which shouldn't be cached.
+    """
+    resp = send_file(png_bytes, mimetype="image/png")
+    resp.cache_control.no_store = True
+    return resp
+
+
 @app.route("/upload", methods=["POST"])
 def upload_file():
-    uploaded_file = request.files["file"]
+    try:
+        uploaded_file = request.files["file"]
+    except RequestEntityTooLarge:
+        error = "That file is too large to have come from Flourish"
+        return render_template("upload.html", error=error)
     if uploaded_file.filename.endswith(".png"):
         try:
-            pngio = BytesIO()
-            uploaded_file.save(pngio)
-            pngio.seek(0)
-            im = Image.open(pngio)
-            params = im.info.get(PNG_STATE_KEY)
+            params = find_text(
+                uploaded_file.stream, PNG_STATE_KEY, max_bytes=MAX_UPLOAD_SCAN_BYTES
+            )
             if params:
                 slug = dict_to_slug(json.loads(params))
                 return redirect(f"/one/{slug}")
@@ -228,6 +595,35 @@ def one_url(route, curve, **kwargs):
     return f"{route}/{slug}"
 
 
+@app.route("/metrics")
+def metrics():
+    """
+    Timing histograms and cache statistics, in Prometheus text format.
+
+    Only available with the bearer token from METRICS_TOKEN_ENV, since
+    behind a proxy we can't tell where requests come from.
+    """
+    token = os.environ.get(METRICS_TOKEN_ENV)
+    if not token:
+        abort(404)
+    scheme, _, given = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        given.encode("utf-8"), token.encode("utf-8")
+    ):
+        abort(404)
+    lines = PHASE_SECONDS.exposition() + REQUEST_SECONDS.exposition()
+    stats = sample_cache.stats()
+    for name in ["hits", "misses"]:
+        lines.append(f"# TYPE flourish_sample_cache_{name}_total counter")
+        lines.append(f"flourish_sample_cache_{name}_total {stats[name]}")
+    for name in ["entries", "nbytes"]:
+        lines.append(f"# TYPE flourish_sample_cache_{name} gauge")
+        lines.append(f"flourish_sample_cache_{name} {stats[name]}")
+    resp = make_response("\n".join(lines) + "\n")
+    resp.content_type = "text/plain; version=0.0.4; charset=utf-8"
+    return resp
+
+
 @app.route("/robots.txt")
 def robots_txt():
     return textwrap.dedent(